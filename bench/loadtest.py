@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import runpy
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+
+from telegram import Update
+
+from stubs import parse_latency, serve
+
+# Load test for the payment conversation. Runs the real handlers of
+# kiris-v3.py (WooCommerce) or kiris-shopify.py (Shopify) against local stubs
+# of every external service and reports conversations/sec and p50/p99 per
+# step. From the repository root:
+#
+#   python bench/loadtest.py --store woocommerce --customers 200 --conversations 2000 \
+#       --latency woocommerce=0.15 --latency telegram=0.05 --latency sheets=0.4
+#
+# Each simulated customer has its own chat and goes through start -> order
+# number -> network -> hash -> confirmation, as many times as needed to reach
+# --conversations in total (with --deep-link the order number comes with the
+# start command). Updates go through the application's update processor, as
+# in polling mode, so the concurrent_updates limit and the per-chat ordering
+# apply as in production. The report adds the latency of the messages the
+# outbox delivered to Telegram (kiris_external_call_seconds).
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+BOTS = {
+    'woocommerce': ('kiris-v3.py', '/pagar'),
+    'shopify': ('kiris-shopify.py', '/start'),
+}
+STEPS = ['start', 'order_number', 'network', 'hash', 'confirm']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Los stubs no respondieron en el puerto {port}")
+
+
+# Looks like the gspread client as far as SheetsWriter is concerned, but
+# append_rows posts to the stub (from SheetsWriter's worker thread)
+class StubSheetsClient:
+    def __init__(self, url):
+        self.url = url
+
+    def open_by_key(self, key):
+        return self
+
+    def worksheet(self, name):
+        return self
+
+    def append_rows(self, rows, **kwargs):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(rows, default=str).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        return json.loads(urllib.request.urlopen(request, timeout=30).read())
+
+
+# Load a bot script with every service pointed at the stubs
+def load_bot(store, stub_url, workdir, session_backend):
+    os.environ.update({
+        'API_URL': stub_url,
+        'API_CONSUMER_KEY': 'ck_bench',
+        'API_CONSUMER_SECRET': 'cs_bench',
+        'SHOP_DOMAIN': 'bench.myshopify.com',
+        'TELEGRAM_BOT_TOKEN': '123456:bench',
+        'TELEGRAM_API_URL': f'{stub_url}/bot',
+        'WALLET_ADDRESS_TRON': 'TBenchWalletTron',
+        'WALLET_ADDRESS_ETH': '0xBenchWalletEth',
+        'COMMISSION_VALUE': '3',
+        'GSPREAD_API_KEY': 'bench',
+        'PAYMENTS_DB': os.path.join(workdir, 'payments.db'),
+        'LEDGER_DB': os.path.join(workdir, 'ledger.db'),
+        'SESSION_BACKEND': session_backend,
+        'SESSION_DB': os.path.join(workdir, 'sessions.db'),
+    })
+    script, command = BOTS[store]
+    runtime = runpy.run_path(os.path.join(ROOT, script), run_name='loadtest')['runtime']
+
+    runtime.trm_cache.url = f'{stub_url}/resource/mcec-87by.json'
+    runtime.sheets_writer.client = StubSheetsClient(f'{stub_url}/sheets/append')
+    if store == 'shopify':
+        # ShopifyAPI always builds an https:// URL
+        runtime.stores.get('shopify').backend.base_url = f'{stub_url}/admin/api/2023-10/'
+    return runtime, command
+
+
+class Customer:
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.user = {'id': chat_id, 'is_bot': False, 'first_name': 'Cliente'}
+        self.chat = {'id': chat_id, 'type': 'private'}
+
+    def message(self, update_id, text):
+        message = {'message_id': update_id, 'date': int(time.time()), 'chat': self.chat, 'from': self.user, 'text': text}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+
+    def button(self, update_id, data):
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id),
+            'from': self.user,
+            'chat_instance': str(self.chat_id),
+            'data': data,
+            'message': {'message_id': update_id, 'date': int(time.time()), 'chat': self.chat, 'text': '...'},
+        }}
+
+
+async def run(args):
+    stub_port = free_port()
+    stub = multiprocessing.Process(target=serve, args=(stub_port, parse_latency(args.latency), args.jitter), daemon=True)
+    stub.start()
+    wait_for_port(stub_port)
+    stub_url = f'http://127.0.0.1:{stub_port}'
+
+    workdir = tempfile.mkdtemp(prefix='kiris-bench-')
+    runtime, command = load_bot(args.store, stub_url, workdir, args.session_backend)
+    application = runtime.bots[0].application
+
+    await application.initialize()
+    await application.post_init(application)
+
+    timings = defaultdict(list)
+    update_ids = iter(range(1, 10 ** 9))
+    remaining = [args.conversations]
+    order_numbers = iter(range(10 ** 7, 10 ** 9))
+    failures = [0]
+
+    async def step(name, data):
+        started = time.perf_counter()
+        update = Update.de_json(data, application.bot)
+        await application.update_processor.process_update(update, application.process_update(update))
+        timings[name].append(time.perf_counter() - started)
+        if args.think:
+            await asyncio.sleep(args.think)
+
+    async def customer(chat_id):
+        customer = Customer(chat_id)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            order_number = str(1000 + chat_id if args.repeat_orders else next(order_numbers))
+            started = time.perf_counter()
+            try:
+                if args.deep_link:
+                    await step('start', customer.message(next(update_ids), f'{command} {order_number}'))
+                else:
+                    await step('start', customer.message(next(update_ids), command))
+                    await step('order_number', customer.message(next(update_ids), order_number))
+                await step('network', customer.button(next(update_ids), args.network))
+                await step('hash', customer.message(next(update_ids), f'0xbench{chat_id}{order_number}'))
+                await step('confirm', customer.button(next(update_ids), 'yes'))
+            except Exception as e:
+                failures[0] += 1
+                print(f"Conversación fallida en el chat {chat_id}: {e!r}")
+                continue
+            timings['conversation'].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(customer(10 ** 6 + i) for i in range(args.customers)))
+    handled = time.perf_counter() - started
+
+    # What is still queued (outgoing messages, ledger rows) is part of the load too
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+    drained = time.perf_counter() - started
+
+    stub.terminate()
+    report(args, timings, handled, drained, failures[0])
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# From the histogram buckets: the bound below which that fraction of the calls fell
+def bucket_percentile(buckets, series, fraction):
+    for bound, count in zip(buckets, series):
+        if count >= fraction * series[-1]:
+            return bound
+    return float('inf')
+
+
+# Outgoing messages by operation (send_message, send_photo) and outcome, as
+# the bot's own histogram recorded them
+def telegram_latency():
+    from includes.metrics import external_call_seconds
+    with external_call_seconds._lock:
+        series = {labels[1:]: list(values) for labels, values in external_call_seconds._values.items() if labels[0] == 'telegram'}
+    return external_call_seconds.buckets, series
+
+
+def report(args, timings, handled, drained, failures):
+    completed = len(timings['conversation'])
+    print(f"\n{args.store}: {completed} conversaciones, {args.customers} clientes simultáneos, {failures} fallidas")
+    print(f"Conversaciones/s: {completed / handled:.1f} (handlers {handled:.2f}s, con envíos pendientes {drained:.2f}s)")
+    print(f"{'paso':<14}{'n':>8}{'p50 ms':>10}{'p99 ms':>10}{'media ms':>10}")
+    for name in STEPS + ['conversation']:
+        values = timings.get(name)
+        if not values:
+            continue
+        print(f"{name:<14}{len(values):>8}{percentile(values, 0.5) * 1000:>10.1f}"
+              f"{percentile(values, 0.99) * 1000:>10.1f}{statistics.fmean(values) * 1000:>10.1f}")
+
+    buckets, sends = telegram_latency()
+    print("\nEnvíos a Telegram (p50/p99 según los buckets del histograma)")
+    print(f"{'operación':<24}{'n':>8}{'p50 ms':>10}{'p99 ms':>10}{'media ms':>10}")
+    for (operation, outcome), series in sorted(sends.items()):
+        print(f"{operation + ' ' + outcome:<24}{series[-1]:>8}{bucket_percentile(buckets, series, 0.5) * 1000:>10.0f}"
+              f"{bucket_percentile(buckets, series, 0.99) * 1000:>10.0f}{series[-2] / series[-1] * 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga del bot de pagos contra servicios simulados')
+    parser.add_argument('--store', choices=sorted(BOTS), default='woocommerce')
+    parser.add_argument('--customers', type=int, default=50, help='clientes simultáneos')
+    parser.add_argument('--conversations', type=int, default=500, help='conversaciones en total')
+    parser.add_argument('--latency', action='append', metavar='SERVICIO=SEGUNDOS',
+                        help='latencia de woocommerce, shopify, trm, sheets o telegram (repetible)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='latencia aleatoria extra, hasta estos segundos')
+    parser.add_argument('--think', type=float, default=0.0, help='pausa del cliente entre pasos, en segundos')
+    parser.add_argument('--network', choices=['TRON', 'ETH'], default='TRON')
+    parser.add_argument('--repeat-orders', action='store_true',
+                        help='cada cliente repite su número de orden: usa la caché de órdenes, '
+                             'pero el ledger rechaza la confirmación repetida')
+    parser.add_argument('--deep-link', action='store_true',
+                        help='el número de orden llega con el comando, como desde el enlace de la tienda')
+    parser.add_argument('--session-backend', choices=['memory', 'sqlite'], default='memory')
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
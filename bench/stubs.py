@@ -0,0 +1,204 @@
+import asyncio
+import json
+import random
+import re
+import time
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+
+# Local stand-ins for every service the bots talk to, all on one port:
+#
+#   /wp-json/wc/v3/orders/<id>             WooCommerce REST API
+#   /admin/api/<version>/orders/<id>.json  Shopify Admin API
+#   /resource/mcec-87by.json               TRM (datos.gov.co)
+#   /sheets/append                         Google Sheets append_rows
+#   /bot<token>/<method>                   Telegram Bot API
+#   /rpc                                   EVM / TronGrid JSON-RPC node
+#
+# `latency` maps a service name (woocommerce, shopify, trm, sheets, telegram, rpc)
+# to the seconds each response is held back, plus up to `jitter` seconds more.
+
+ORDER_TOTAL = "250000"
+
+
+def order(order_id):
+    return {
+        "id": int(order_id),
+        "status": "pending",
+        "total": ORDER_TOTAL,
+        "total_price": ORDER_TOTAL,
+        "line_items": [{"quantity": 1, "name": "Producto", "title": "Producto"}],
+        "meta_data": [],
+    }
+
+
+class StubHandler(tornado.web.RequestHandler):
+    service = None
+
+    def initialize(self, latency, jitter):
+        self.latency = latency
+        self.jitter = jitter
+
+    async def prepare(self):
+        delay = self.latency.get(self.service, 0)
+        if delay or self.jitter:
+            await asyncio.sleep(delay + random.random() * self.jitter)
+
+    def reply(self, data):
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(data))
+
+
+class WooCommerceOrderHandler(StubHandler):
+    service = "woocommerce"
+
+    def get(self, order_id):
+        self.reply(order(order_id))
+
+    def put(self, order_id):
+        self.reply(dict(order(order_id), **json.loads(self.request.body or b"{}")))
+
+
+class ShopifyOrderHandler(StubHandler):
+    service = "shopify"
+
+    def get(self, version, order_id):
+        self.reply({"order": order(order_id)})
+
+    def put(self, version, order_id):
+        data = json.loads(self.request.body or b"{}").get("order", {})
+        self.reply({"order": dict(order(order_id), **data)})
+
+
+class TRMHandler(StubHandler):
+    service = "trm"
+
+    def get(self):
+        self.reply([{"valor": "4000.00", "vigenciadesde": "2024-01-01T00:00:00.000"}])
+
+
+class SheetsHandler(StubHandler):
+    service = "sheets"
+    last_row = 1  # The header
+
+    def post(self):
+        rows = json.loads(self.request.body or b"[]")
+        first = SheetsHandler.last_row + 1
+        SheetsHandler.last_row += len(rows)
+        self.reply({"updates": {
+            "updatedRange": f"Transacciones!A{first}:K{SheetsHandler.last_row}",
+            "updatedRows": len(rows),
+        }})
+
+
+class BotAPIHandler(StubHandler):
+    service = "telegram"
+    message_id = 0
+
+    def post(self, token, method):
+        params = self.params()
+        if method == "getMe":
+            return self.reply({"ok": True, "result": {
+                "id": 1, "is_bot": True, "first_name": "Kiris", "username": "kiris_bench_bot",
+                "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False,
+            }})
+        if method in ("sendMessage", "sendPhoto"):
+            BotAPIHandler.message_id += 1
+            message = {
+                "message_id": BotAPIHandler.message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            }
+            if method == "sendPhoto":
+                message["photo"] = [{"file_id": "bench-photo", "file_unique_id": "bench-photo", "width": 300, "height": 300}]
+                message["caption"] = params.get("caption")
+            else:
+                message["text"] = params.get("text", "")
+            return self.reply({"ok": True, "result": message})
+        # answerCallbackQuery, setWebhook, deleteWebhook...
+        self.reply({"ok": True, "result": True})
+
+    get = post
+
+    # PTB sends JSON, form fields or multipart (for photos)
+    def params(self):
+        if self.request.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(self.request.body or b"{}")
+        return {name: values[0].decode() for name, values in self.request.body_arguments.items()}
+
+
+# Receipts of hashes ending in an even hex digit are successful, those ending
+# in "f" failed and the rest are unknown (still pending). Each one carries a
+# USDT (ERC-20) transfer to RPC_WALLET of as many dollars as the hash's
+# second to last hex digit.
+RPC_WALLET = "0x" + "11" * 20
+RPC_TOKEN = "0xdac17f958d2ee523a2206206994597c13d831ec7"
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+
+class JSONRPCHandler(StubHandler):
+    service = "rpc"
+    head = 1000
+    requests = 0
+
+    def post(self):
+        JSONRPCHandler.requests += 1
+        calls = json.loads(self.request.body or b"[]")
+        if isinstance(calls, dict):
+            return self.reply(self.call(calls))
+        self.reply([self.call(call) for call in calls])
+
+    def call(self, call):
+        reply = {"jsonrpc": "2.0", "id": call.get("id")}
+        if call.get("method") == "eth_blockNumber":
+            return dict(reply, result=hex(self.head))
+        if call.get("method") != "eth_getTransactionReceipt":
+            return dict(reply, error={"code": -32601, "message": "Method not found"})
+        txn_hash = call["params"][0]
+        last = int(txn_hash[-1], 16)
+        if last % 2 and last != 15:
+            return dict(reply, result=None)
+        return dict(reply, result={
+            "transactionHash": txn_hash,
+            "blockNumber": hex(self.head - last),
+            "status": "0x0" if last == 15 else "0x1",
+            "logs": [{
+                "address": RPC_TOKEN,
+                "topics": [TRANSFER_TOPIC, "0x" + "22" * 32, "0x" + "0" * 24 + RPC_WALLET[2:]],
+                "data": hex(int(txn_hash[-2], 16) * 10 ** 6),
+            }],
+        })
+
+
+def make_app(latency=None, jitter=0.0):
+    options = dict(latency=latency or {}, jitter=jitter)
+    return tornado.web.Application([
+        (r"/wp-json/wc/v3/orders/(\d+)", WooCommerceOrderHandler, options),
+        (r"/admin/api/([^/]+)/orders/(\d+)\.json", ShopifyOrderHandler, options),
+        (r"/resource/mcec-87by\.json", TRMHandler, options),
+        (r"/sheets/append", SheetsHandler, options),
+        (r"/bot([^/]+)/(\w+)", BotAPIHandler, options),
+        (r"/rpc", JSONRPCHandler, options),
+    ])
+
+
+# Entry point of the stub process started by loadtest.py
+def serve(port, latency=None, jitter=0.0):
+    async def main():
+        server = HTTPServer(make_app(latency, jitter))
+        server.listen(port, address="127.0.0.1")
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def parse_latency(values):
+    latency = {}
+    for value in values or []:
+        match = re.fullmatch(r"(\w+)=([\d.]+)", value)
+        if match is None:
+            raise ValueError(f"Expected service=seconds, got {value!r}")
+        latency[match.group(1)] = float(match.group(2))
+    return latency
@@ -0,0 +1,448 @@
+import asyncio
+import datetime
+import os
+import signal
+from functools import partial
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, CallbackQueryHandler, MessageHandler, filters, CallbackContext
+
+from includes.commerce import OrderCache, SharedClient
+from includes.ledger import Ledger, SHEET_COLUMNS
+from includes.metrics import start_metrics_server, start_profiler, mark_ready_when_polling, ready
+from includes.payments import PendingPayments
+from includes.resilience import UPSTREAM_ERRORS, with_deadline
+from includes.sender import Outbox
+from includes.sessions import open_session_store
+from includes.sheets import SheetsWriter
+from includes.stores import COMMISSION_NOTICE, NETWORK_LABELS, StoreRegistry, open_store
+from includes.trm import TRMCache
+
+
+# Everything one process shares between its stores and bots: the HTTP pool
+# and order cache of the store clients, the TRM, the ledger and its Sheets
+# export, and the pending payments. Each Telegram bot gets a ChatBot with its
+# own application, outbox and sessions. Configured from the environment like
+# the scripts that use it (kiris.py, kiris-v3.py, kiris-shopify.py).
+class Runtime:
+    def __init__(self, store_configs, sheet_columns=SHEET_COLUMNS):
+        # Store clients: one connection pool and one order cache for all of them
+        self.pool = SharedClient()
+        self.order_cache = OrderCache(
+            ttl=int(os.getenv('ORDER_CACHE_TTL', '60')),
+            max_size=int(os.getenv('ORDER_CACHE_SIZE', '1000'))
+        )
+        hedge_after = float(os.getenv('ORDER_HEDGE_AFTER')) if os.getenv('ORDER_HEDGE_AFTER') else None  # Second lookup if the first is slow
+        self.stores = StoreRegistry([
+            open_store(config, self.pool, self.order_cache, hedge_after=hedge_after) for config in store_configs
+        ])
+
+        # Exchange rate shared by every conversation
+        self.trm_cache = TRMCache(
+            ttl=int(os.getenv('TRM_TTL', '3600')),
+            timeout=float(os.getenv('TRM_TIMEOUT', '5'))
+        )
+
+        # Every confirmed payment is recorded here first; duplicate hashes and orders are rejected
+        self.ledger = Ledger(os.getenv('LEDGER_DB', 'ledger.db'))
+
+        # The "Transacciones" worksheet is an export of the ledger, appended in batches by a background task
+        self.sheets_writer = SheetsWriter(
+            os.getenv('GSPREAD_API_KEY', ''),
+            "Transacciones",
+            self.ledger,
+            credentials_file="credentials.json",  # Authorized on the first export
+            columns=sheet_columns,
+            batch_size=int(os.getenv('SHEETS_BATCH_SIZE', '50')),
+            flush_interval=float(os.getenv('SHEETS_FLUSH_INTERVAL', '2'))
+        )
+
+        # Quotes waiting for payment, shared with the payment watcher
+        self.payments = PendingPayments(os.getenv('PAYMENTS_DB', 'payments.db'))
+
+        # Every update gets CONVERSATION_DEADLINE seconds for its calls to the
+        # store and the TRM
+        self.conversation_deadline = float(os.getenv('CONVERSATION_DEADLINE', '20'))
+
+        bots = self.stores.by_bot()
+        self.bots = [ChatBot(self, token, stores, len(bots)) for token, stores in bots.items()]
+        self.store_webhook_server = None
+        self._open = 0
+
+    @property
+    def applications(self):
+        return [bot.application for bot in self.bots]
+
+    # Background services, started with the first application: warm the
+    # exchange rate, start the Sheets export, the store webhooks and report readiness
+    async def open(self):
+        self._open += 1
+        if self._open > 1:
+            return
+        self.trm_cache.refresh_in_background()
+        await self.sheets_writer.start()
+        # New and updated orders pushed by the stores, so the customer's first lookup is already cached.
+        # Kept no longer than a looked-up order: another replica may have taken the payment meanwhile,
+        # and its write only invalidates its own cache.
+        if os.getenv('STORE_WEBHOOK_PORT'):
+            from includes.store_webhooks import start_store_webhooks  # tornado, only when enabled
+            self.store_webhook_server = start_store_webhooks(
+                list(self.stores),
+                int(os.getenv('STORE_WEBHOOK_PORT')),
+                url_path=os.getenv('STORE_WEBHOOK_PATH', 'store'),
+                ttl=min(int(os.getenv('ORDER_WEBHOOK_TTL', '60')), self.order_cache.ttl)
+            )
+        if not os.getenv('WEBHOOK_URL'):
+            asyncio.get_running_loop().create_task(mark_ready_when_polling(*self.applications))
+
+    async def stop(self):
+        ready.clear()
+        if self.store_webhook_server is not None:
+            self.store_webhook_server.stop()
+            self.store_webhook_server = None
+
+    # Closed with the last application
+    async def close(self):
+        self._open -= 1
+        if self._open > 0:
+            return
+        await self.sheets_writer.close()
+        await self.trm_cache.aclose()
+        for store in self.stores:
+            await store.backend.aclose()
+        await self.pool.aclose()
+
+    def run(self):
+        # Prometheus /metrics and the /ready probe, and a sampling profiler at /debug/profile when PROFILE_INTERVAL is set
+        if os.getenv('METRICS_PORT'):
+            start_metrics_server(int(os.getenv('METRICS_PORT')), os.getenv('METRICS_ADDRESS', '127.0.0.1'))
+        if os.getenv('PROFILE_INTERVAL'):
+            start_profiler(float(os.getenv('PROFILE_INTERVAL')))
+
+        # Webhook mode when a public URL is configured, long polling otherwise
+        if os.getenv('WEBHOOK_URL'):
+            from includes.webhook import run_webhook
+            run_webhook(
+                self.applications,
+                webhook_url=os.getenv('WEBHOOK_URL'),
+                port=int(os.getenv('WEBHOOK_PORT', '8080')),
+                url_path=os.getenv('WEBHOOK_PATH', 'telegram'),
+                secret_token=os.getenv('WEBHOOK_SECRET') or None,
+                workers=int(os.getenv('WEBHOOK_WORKERS', '32')),
+                queue_size=int(os.getenv('WEBHOOK_QUEUE_SIZE', '100'))
+            )
+        elif len(self.bots) == 1:
+            self.bots[0].application.run_polling()
+        else:
+            asyncio.run(self._poll())
+
+    # Long polling for several bots; Application.run_polling handles only one
+    async def _poll(self):
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        for application in self.applications:
+            await application.initialize()
+            await application.post_init(application)
+            await application.updater.start_polling()
+            await application.start()
+        try:
+            await stop.wait()
+        finally:
+            for application in self.applications:
+                await application.updater.stop()
+                await application.stop()
+                await application.post_stop(application)
+            for application in self.applications:
+                await application.shutdown()
+                await application.post_shutdown(application)
+
+
+# Runs up to max_concurrent_updates updates at once in polling mode, but
+# those of the same chat one after the other, in the order they arrived, as
+# ChatDispatcher does for webhooks. Handlers read the session, await the
+# store or Telegram and save it; two updates of one chat in flight at once
+# (a double tap on "Sí", a hash typed right after the network button) would
+# each act on the same state. Updates without a chat run unordered.
+# A queued update waits for its chat first and only then for a slot, so one
+# chat's burst holds a single slot and does not keep the others waiting.
+class ChatUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._chats = {}  # chat_id -> [lock, updates holding or waiting for it]
+
+    async def process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._chats.get(chat.id)
+        if entry is None:
+            entry = self._chats[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[chat.id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+# The payment conversation on one Telegram bot, for the stores it serves
+class ChatBot:
+    def __init__(self, runtime, token, stores, bot_count=1):
+        self.runtime = runtime
+        self.token = token
+        self.stores = stores
+
+        self.application = (
+            Application.builder()
+            .token(token)
+            .base_url(os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot'))  # A local Bot API server, or the bench stubs
+            .concurrent_updates(ChatUpdateProcessor(int(os.getenv('CONCURRENT_UPDATES', '256'))))
+            .post_init(self.post_init)
+            .post_stop(self.post_stop)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
+
+        # Outgoing messages are merged and paced to Telegram's flood limits
+        self.outbox = Outbox(
+            self.application.bot,
+            per_chat_interval=float(os.getenv('TELEGRAM_CHAT_INTERVAL', '1')),
+            global_rate=float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+        )
+
+        # Conversation state, one session per chat. SESSION_BACKEND=sqlite shares it
+        # between replicas and keeps it across restarts. Chat ids are only unique
+        # within a bot, so with several bots each one has its own database.
+        session_path = os.getenv('SESSION_DB', 'sessions.db')
+        if bot_count > 1:
+            base, ext = os.path.splitext(session_path)
+            session_path = f"{base}-{token.split(':')[0]}{ext}"
+        self.sessions = open_session_store(
+            os.getenv('SESSION_BACKEND', 'memory'),
+            path=session_path,
+            ttl=int(os.getenv('SESSION_TTL', '1800')),
+            max_sessions=int(os.getenv('SESSION_MAX', '10000')),
+            shards=int(os.getenv('SESSION_SHARDS', '1'))
+        )
+
+        deadline = runtime.conversation_deadline
+        commands = list(dict.fromkeys(store.command for store in stores))
+        self.application.add_handler(CommandHandler(commands, with_deadline(self.start, deadline, self.upstream_error)))
+        self.application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), with_deadline(self.handle_message, deadline, self.upstream_error)))
+        self.application.add_handler(CallbackQueryHandler(with_deadline(self.button, deadline, self.upstream_error)))
+
+    async def post_init(self, application: Application):
+        await self.runtime.open()
+
+    async def post_stop(self, application: Application):
+        await self.runtime.stop()
+        await self.outbox.close()
+
+    async def post_shutdown(self, application: Application):
+        await self.runtime.close()
+
+    # The store of the conversation, the bot's default one for sessions
+    # saved without it
+    def store_of(self, session):
+        return self.runtime.stores.get(session.store) or self.stores[0]
+
+    # Past the deadline, or with an upstream down, the customer is asked to
+    # retry instead of waiting on a request that will not come back
+    async def upstream_error(self, update: Update, error):
+        print(f"Servicio externo no disponible: {error!r}")
+        if update.effective_chat is not None:
+            self.outbox.send_message(chat_id=update.effective_chat.id, text="En este momento no podemos consultar la tienda. Por favor, intenta de nuevo en unos minutos.")
+
+    async def start(self, update: Update, context: CallbackContext):
+        session = self.sessions.get(update.effective_chat.id)
+        session.reset()
+        session.state = "AWAITING_ORDER_NUMBER"
+
+        # Check if the start command has any arguments ("<order>" or "<prefix>-<order>")
+        argument = context.args[0] if context.args else None
+        store, order_number = self.runtime.stores.resolve(self.token, argument)
+        session.store = store.name
+        self.sessions.save(session)
+
+        if order_number:
+            session.order_number = order_number
+            self.outbox.send_message(chat_id=update.effective_chat.id, text=f"Numero de orden: {session.order_number}")
+            print(f"Order number from request: {session.order_number} ({store.name})")  # Order number from request
+            # The link already carries the order, quote it without waiting for the customer to type it
+            await self.send_quote(update, session)
+        else:
+            self.outbox.send_message(chat_id=update.effective_chat.id, text="Hola, ¿cuál es tu número de orden?")
+
+    # Show the order and its price in USDT, then ask for the network. The
+    # order and the exchange rate are fetched at the same time, so the quote
+    # waits for the slower of the two instead of both one after the other.
+    async def send_quote(self, update: Update, session):
+        store = self.store_of(session)
+        order, session.trm_value = await asyncio.gather(
+            store.backend.get_order(session.order_number),
+            self.runtime.trm_cache.get()
+        )
+
+        if not order:
+            self.outbox.send_message(chat_id=update.effective_chat.id, text="La orden no ha sido encontrada. Por favor, ingresa nuevamente el número de orden.")
+            return
+
+        order_status = order.get('status')
+        if order_status != 'pending':
+            self.outbox.send_message(chat_id=update.effective_chat.id, text=f"La orden ya fue actualizada, estado de la orden: {order_status}.")
+            return
+
+        session.order_total = store.backend.order_total(order)  # Total in COP
+        order_items = order.get('line_items')
+        meta_data = order.get('meta_data', [])
+        from babel.numbers import format_currency  # Loaded on the first quote, not at startup
+        order_total_formatted = format_currency(session.order_total, 'COP', locale='es_CO')
+
+        bot_fields_exist = any(meta.get('key') == 'txn_hash' or meta.get('key') == 'network' for meta in meta_data)
+        if bot_fields_exist:
+            self.outbox.send_message(chat_id=update.effective_chat.id, text="No es posible actualizar la transacción a través del bot. Por favor, contáctanos en https://kiris.store para resolver tu problema, puede corregir su número de orden a continuación")
+            session.reset()
+            session.state = "AWAITING_ORDER_NUMBER"
+            session.store = store.name
+            self.sessions.save(session)
+            self.outbox.send_message(chat_id=update.effective_chat.id, text="Hola, ¿cuál es tu número de orden?")
+            return
+
+        items_text = ""
+        for item in order_items:
+            items_text += f"{item.get('quantity')}x {store.backend.item_title(item)}\n"
+
+        self.outbox.send_message(chat_id=update.effective_chat.id, text=f"Detalles de la orden:\nEstado: {order_status}\nTotal: {order_total_formatted}\nArtículos:\n{items_text}")
+
+        # Convertir el total de COP a USD, con la comisión de la tienda si tiene una
+        session.order_total_usd, session.total_with_commission = store.quote(session.order_total, session.trm_value)
+
+        message = f"Total a pagar: ${store.amount_due(session):.2f} USDT\n\n{store.notice}\n\nEl precio actual del dólar en COP es {session.trm_value}."
+        if store.commission:
+            message += f" {COMMISSION_NOTICE}"
+
+        # Enviar el mensaje al usuario
+        self.outbox.send_message(chat_id=update.effective_chat.id, text=message)
+
+        keyboard = [[InlineKeyboardButton(NETWORK_LABELS.get(network, network), callback_data=network) for network in store.networks]]
+
+        reply_markup = InlineKeyboardMarkup(keyboard)
+
+        self.outbox.send_message(chat_id=update.effective_chat.id, text='Por favor elige la red por la que desea hacer el pago:', reply_markup=reply_markup)
+        session.state = "AWAITING_CRYPTO_CHOICE"
+        self.sessions.save(session)
+
+    async def handle_message(self, update: Update, context: CallbackContext):
+        session = self.sessions.get(update.effective_chat.id)
+        if session.state == "AWAITING_ORDER_NUMBER":
+            # A "<prefix>-<order>" typed by hand also picks the store
+            store, session.order_number = self.runtime.stores.resolve(self.token, update.message.text, self.store_of(session))
+            session.store = store.name
+            await self.send_quote(update, session)
+        elif session.state == "AWAITING_TRANSACTION_HASH":
+            if self.runtime.ledger.find_hash(update.message.text) is not None:
+                self.outbox.send_message(chat_id=update.effective_chat.id, text="Este hash ya fue registrado para otra orden. Por favor, verifica y envía el hash de tu pago.")
+                return
+            session.transaction_hash = update.message.text
+            keyboard = [[InlineKeyboardButton("Sí", callback_data='yes'),
+                         InlineKeyboardButton("No", callback_data='no')]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            self.outbox.send_message(chat_id=update.effective_chat.id, text=f"Has proporcionado el hash: {session.transaction_hash}\n ¿Es correcto?", reply_markup=reply_markup)
+            session.state = "AWAITING_HASH_CONFIRMATION"
+            self.sessions.save(session)
+
+    async def button(self, update: Update, context: CallbackContext):
+        session = self.sessions.get(update.effective_chat.id)
+        store = self.store_of(session)
+        query = update.callback_query
+        await query.answer()
+        if session.state == "AWAITING_CRYPTO_CHOICE":
+            if query.data not in store.networks:
+                return
+            session.crypto_choice = query.data
+            session.wallet_address = store.wallet_addresses[session.crypto_choice]
+
+            photo = store.wallet_qr_codes.photo(session.crypto_choice)
+            self.outbox.send_photo(chat_id=update.effective_chat.id, photo=photo, on_sent=partial(store.wallet_qr_codes.remember, session.crypto_choice))
+
+            self.outbox.send_message(chat_id=update.effective_chat.id, text=f"Has seleccionado: {session.crypto_choice}.")
+            self.outbox.send_message(chat_id=update.effective_chat.id, text=f"La dirección de la billetera es: ")
+            # The address goes on its own, as code, so it can be copied with a tap
+            self.outbox.send_message(chat_id=update.effective_chat.id, text=f"<code>{session.wallet_address}</code>", parse_mode=ParseMode.HTML)
+            self.outbox.send_message(chat_id=update.effective_chat.id, text=f"El total a pagar es: ${store.amount_due(session)} USDT")
+            self.outbox.send_message(chat_id=update.effective_chat.id, text=f"Por favor realiza el pago y envíanos el hash de la transacción en forma de texto por este medio, se actualizará tu orden y verificaremos tu pago, en caso de tener alguna duda, comunícate con nosotros en https://kiris.store")
+
+            # The watcher can now match an incoming transfer to this order
+            self.runtime.payments.add(
+                store.key, session.order_number, session.crypto_choice, session.wallet_address,
+                store.amount_due(session), update.effective_chat.id,
+                order_total=session.order_total,
+                trm=session.trm_value,
+                order_total_usd=session.order_total_usd,
+                total_with_commission=session.total_with_commission
+            )
+
+            session.state = "AWAITING_TRANSACTION_HASH"
+            self.sessions.save(session)
+        elif session.state == "AWAITING_HASH_CONFIRMATION":
+            if query.data == 'yes':
+                # Registrar el pago en el ledger; un hash u orden ya registrados no se aceptan
+                recorded = self.runtime.ledger.record(
+                    store.key,
+                    session.order_number,
+                    session.transaction_hash,
+                    network=session.crypto_choice,
+                    wallet_address=session.wallet_address,
+                    order_total=session.order_total,
+                    trm=session.trm_value,
+                    order_total_usd=session.order_total_usd,
+                    total_with_commission=session.total_with_commission,
+                    date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                )
+                if not recorded:
+                    self.outbox.send_message(chat_id=update.effective_chat.id, text="Este pago ya fue registrado. Si crees que es un error, contáctanos en https://kiris.store")
+                    self.sessions.drop(session)
+                    return
+
+                self.runtime.payments.set_hash(store.key, session.order_number, session.transaction_hash)
+
+                # La hoja de Google se actualiza desde el ledger en segundo plano
+                self.runtime.sheets_writer.notify()
+
+                # The payment is already in the ledger; if the store does not answer the
+                # validator still promotes the order once the transaction is confirmed
+                try:
+                    updated = await store.backend.confirm_payment(session.order_number, session.transaction_hash, session.crypto_choice)
+                except UPSTREAM_ERRORS as e:
+                    print(f"No se pudo actualizar la orden {session.order_number}: {e!r}")
+                    updated = False
+
+                if updated:  # Check if the order was updated successfully
+                    self.outbox.send_message(chat_id=update.effective_chat.id, text="La orden se ha actualizado con éxito.")
+                else:
+                    self.outbox.send_message(chat_id=update.effective_chat.id, text="Hubo un problema al actualizar la orden.")
+
+                self.outbox.send_message(chat_id=update.effective_chat.id, text="Gracias por tu información. Tu orden ha sido actualizada, pronto recibirá un correo electrónico con el estado de su pedido. ¡Hasta luego!")
+                self.sessions.drop(session)
+            else:
+                session.transaction_hash = None
+                self.outbox.send_message(chat_id=update.effective_chat.id, text="Por favor, proporciona nuevamente el hash de la transacción.")
+                session.state = "AWAITING_TRANSACTION_HASH"
+                self.sessions.save(session)
@@ -0,0 +1,299 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+import httpx
+
+from includes.metrics import cache_lookup, observe
+from includes.resilience import Dependency
+
+
+# Only the order fields the bot reads are requested from the stores
+WOOCOMMERCE_ORDER_FIELDS = "id,status,total,line_items,meta_data"
+SHOPIFY_ORDER_FIELDS = "id,status,total_price,line_items,meta_data"
+
+# One keep-alive pool per store client, reused by every conversation
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+
+
+# Short-lived cache of orders keyed by (store, order id). Customers often
+# send the same order number again or restart the flow; those lookups are
+# answered from memory. Our own writes invalidate the entry. Orders pushed by
+# the store webhooks can be given their own ttl, at most the cache's. Least
+# recently used entries are dropped past max_size.
+class OrderCache:
+    def __init__(self, ttl=60, max_size=1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._orders = OrderedDict()
+
+    def get(self, key):
+        entry = self._orders.get(key)
+        if entry is None:
+            return None
+        expires, order = entry
+        if expires < time.monotonic():
+            del self._orders[key]
+            return None
+        self._orders.move_to_end(key)
+        return order
+
+    def put(self, key, order, ttl=None):
+        self._orders[key] = (time.monotonic() + (ttl or self.ttl), order)
+        self._orders.move_to_end(key)
+        while len(self._orders) > self.max_size:
+            self._orders.popitem(last=False)
+
+    def invalidate(self, key):
+        self._orders.pop(key, None)
+
+
+# One connection pool for several store clients, opened on first use
+class SharedClient:
+    def __init__(self, timeout=10):
+        self.timeout = timeout
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=HTTP_LIMITS, headers={"accept": "application/json"})
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+
+# What the conversation needs from a store, whatever the platform. Several
+# backends can share one SharedClient (`pool`) and one OrderCache; cache keys
+# and credentials are per store.
+class CommerceBackend(ABC):
+    platform = None
+
+    # What every backend keeps: the order cache, the Dependency its requests
+    # go through (named after the platform) and either a shared pool or,
+    # created on first use, its own client
+    def __init__(self, timeout=10, cache=None, dependency=None, hedge_after=None, pool=None):
+        self.cache = cache if cache is not None else OrderCache()
+        self.timeout = timeout
+        self.dependency = dependency if dependency is not None else Dependency(self.platform, timeout=timeout)
+        self.hedge_after = hedge_after
+        self.pool = pool
+        self._client = None
+
+    # The order as a dict, or None if it does not exist
+    @abstractmethod
+    async def get_order(self, order_id):
+        pass
+
+    # Order total in COP, as the store sends it
+    @abstractmethod
+    def order_total(self, order):
+        pass
+
+    @abstractmethod
+    def item_title(self, item):
+        pass
+
+    # Attach the customer's payment to the order; True if the store accepted it
+    @abstractmethod
+    async def confirm_payment(self, order_id, txn_hash, network):
+        pass
+
+    # Cache an order received from a store webhook
+    @abstractmethod
+    def prewarm(self, order, ttl=None):
+        pass
+
+    # The connection pool is created on the first request, not at startup
+    @property
+    def client(self):
+        if self.pool is not None:
+            return self.pool.client
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=HTTP_LIMITS, headers={"accept": "application/json"})
+        return self._client
+
+    # A shared pool is closed by its owner
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+
+# Async WooCommerce REST client with the same get/put surface as
+# woocommerce.API, so handlers can await order lookups instead of blocking.
+# Requests go through a Dependency (timeout, retries for GETs, circuit
+# breaker); hedge_after enables hedged order lookups.
+class WooCommerceAPI(CommerceBackend):
+    platform = "woocommerce"
+
+    def __init__(self, url, consumer_key, consumer_secret, version="wc/v3", timeout=10, query_string_auth=False, cache=None,
+                 dependency=None, hedge_after=None, pool=None):
+        self.url = url if url.endswith("/") else f"{url}/"
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.version = version
+        self.query_string_auth = query_string_auth
+        self.is_ssl = url.startswith("https")
+        super().__init__(timeout=timeout, cache=cache, dependency=dependency, hedge_after=hedge_after, pool=pool)
+
+    # The order as a dict (only WOOCOMMERCE_ORDER_FIELDS), or None if it does not exist
+    async def get_order(self, order_id):
+        key = (self.url, str(order_id))
+        order = self.cache.get(key)
+        cache_lookup("orders", order is not None)
+        if order is not None:
+            return order
+
+        with observe("woocommerce", "get_order"):
+            response = await self._request("GET", f"orders/{order_id}", params={"_fields": WOOCOMMERCE_ORDER_FIELDS},
+                                           hedge_after=self.hedge_after)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        order = response.json()
+        self.cache.put(key, order)
+        return order
+
+    # Order sent by an order.created/order.updated webhook, cached so the
+    # customer's lookup needs no request (see includes/store_webhooks.py)
+    def prewarm(self, order, ttl=None):
+        fields = WOOCOMMERCE_ORDER_FIELDS.split(",")
+        self.cache.put((self.url, str(order["id"])), {field: order[field] for field in fields if field in order}, ttl)
+
+    async def update_order(self, order_id, data):
+        self.cache.invalidate((self.url, str(order_id)))
+        with observe("woocommerce", "update_order"):
+            response = await self.put(f"orders/{order_id}", data)
+        return response.json()
+
+    def order_total(self, order):
+        return order.get("total")
+
+    def item_title(self, item):
+        return item.get("name")
+
+    # The order waits on hold, with the hash and network, until the validator confirms the transaction
+    async def confirm_payment(self, order_id, txn_hash, network):
+        response = await self.update_order(order_id, {
+            "status": "on-hold",
+            "meta_data": [
+                {"key": "txn_hash", "value": txn_hash},
+                {"key": "network", "value": network}
+            ]
+        })
+        return "id" in response
+
+    async def get(self, endpoint, params=None):
+        return await self._request("GET", endpoint, params=params)
+
+    async def put(self, endpoint, data):
+        return await self._request("PUT", endpoint, data=data)
+
+    async def post(self, endpoint, data):
+        return await self._request("POST", endpoint, data=data)
+
+    async def _request(self, method, endpoint, params=None, data=None, hedge_after=None):
+        content = None
+        headers = {}
+        if data is not None:
+            content = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            headers["content-type"] = "application/json;charset=utf-8"
+
+        # Signed again on every attempt, OAuth nonces cannot be reused
+        async def send(timeout):
+            url, query, auth = self._sign(method, endpoint, params)
+            return await self.client.request(method, url, params=query, content=content, headers=headers, auth=auth, timeout=timeout)
+
+        return await self.dependency.request(send, idempotent=method == "GET", hedge_after=hedge_after)
+
+    # Same auth rules as woocommerce.API: basic auth (or query string) over
+    # HTTPS, OAuth 1.0a signed URLs over plain HTTP
+    def _sign(self, method, endpoint, params):
+        url = f"{self.url}wp-json/{self.version}/{endpoint}"
+        params = dict(params or {})
+
+        if self.is_ssl and not self.query_string_auth:
+            return url, params, (self.consumer_key, self.consumer_secret)
+        if self.is_ssl:
+            params.update({"consumer_key": self.consumer_key, "consumer_secret": self.consumer_secret})
+            return url, params, None
+
+        from woocommerce.oauth import OAuth  # Plain HTTP stores only
+        url = OAuth(
+            url=f"{url}?{urlencode(params)}",
+            consumer_key=self.consumer_key,
+            consumer_secret=self.consumer_secret,
+            version=self.version,
+            method=method,
+            oauth_timestamp=int(time.time())
+        ).get_oauth_url()
+        return url, None, None
+
+
+# Async Shopify Admin REST client (private app credentials). get_order
+# returns the order dict or None and update_order the decoded response, like
+# the synchronous Shopify client it replaces. Credentials go with each
+# request, so the pool can be shared with other stores.
+class ShopifyAPI(CommerceBackend):
+    platform = "shopify"
+
+    def __init__(self, shop_domain, api_key, api_password, version="2023-10", timeout=10, cache=None,
+                 dependency=None, hedge_after=None, pool=None):
+        shop_domain = shop_domain.replace("https://", "").replace("http://", "").rstrip("/")
+        self.base_url = f"https://{shop_domain}/admin/api/{version}/"
+        self.auth = (api_key, api_password)
+        super().__init__(timeout=timeout, cache=cache, dependency=dependency, hedge_after=hedge_after, pool=pool)
+
+    async def get_order(self, order_id):
+        key = (self.base_url, str(order_id))
+        order = self.cache.get(key)
+        cache_lookup("orders", order is not None)
+        if order is not None:
+            return order
+
+        with observe("shopify", "get_order"):
+            response = await self.dependency.request(
+                lambda timeout: self.client.get(f"{self.base_url}orders/{order_id}.json", params={"fields": SHOPIFY_ORDER_FIELDS},
+                                               auth=self.auth, timeout=timeout),
+                idempotent=True,
+                hedge_after=self.hedge_after
+            )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        order = response.json().get("order")
+        if order is not None:
+            self.cache.put(key, order)
+        return order
+
+    def order_total(self, order):
+        return float(order.get("total_price"))
+
+    def item_title(self, item):
+        return item.get("title")
+
+    async def confirm_payment(self, order_id, txn_hash, network):
+        response = await self.update_order(order_id, {
+            "metafields": [
+                {"key": "txn_hash", "value": txn_hash, "value_type": "string", "namespace": "global"},
+                {"key": "network", "value": network, "value_type": "string", "namespace": "global"}
+            ]
+        })
+        return "order" in response
+
+    # Order sent by an orders/create webhook
+    def prewarm(self, order, ttl=None):
+        fields = SHOPIFY_ORDER_FIELDS.split(",")
+        self.cache.put((self.base_url, str(order["id"])), {field: order[field] for field in fields if field in order}, ttl)
+
+    async def update_order(self, order_id, data):
+        self.cache.invalidate((self.base_url, str(order_id)))
+        with observe("shopify", "update_order"):
+            response = await self.dependency.request(
+                lambda timeout: self.client.put(f"{self.base_url}orders/{order_id}.json", json={"order": data}, auth=self.auth, timeout=timeout)
+            )
+        return response.json()
@@ -0,0 +1,179 @@
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Ledger columns in the order the "Transacciones" worksheet has them
+SHEET_COLUMNS = [
+    'date',
+    'store',
+    'order_number',
+    'order_total',
+    'trm',
+    'order_total_usd',
+    'total_with_commission',
+    'txn_hash',
+    'network',
+    'wallet_address',
+    'txn_status',
+]
+
+# Worksheet headers that differ from the ledger column names
+SHEET_HEADERS = {'API_URL': 'store', 'order': 'order_number', 'TRM': 'trm'}
+
+
+# Local record of every confirmed payment, the system of record for what
+# used to live only in Google Sheets. SQLite in WAL mode, shared by the bots
+# and the validator. Payments are only ever inserted; a transaction hash and
+# an order can each appear once, enforced by unique indexes, so a reused
+# hash is rejected with an index lookup. The worksheet is an export: rows
+# are marked once they have been appended there (see SheetsWriter). Approved
+# rows are also marked once the store has their order as paid (promoted).
+class Ledger:
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL,
+                store TEXT NOT NULL,
+                order_number TEXT NOT NULL,
+                order_total TEXT,
+                trm REAL,
+                order_total_usd REAL,
+                total_with_commission REAL,
+                txn_hash TEXT NOT NULL,
+                network TEXT,
+                wallet_address TEXT,
+                txn_status TEXT NOT NULL DEFAULT '',
+                exported INTEGER NOT NULL DEFAULT 0,
+                sheet_row INTEGER,
+                promoted INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # Databases from before promotions were recorded: their approved orders were
+        # promoted in the same run that approved them
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(transactions)")}
+        if 'promoted' not in columns:
+            self._db.execute("ALTER TABLE transactions ADD COLUMN promoted INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("UPDATE transactions SET promoted = 1 WHERE txn_status = 'Approved'")
+        # Hashes are hex, the same hash may come in upper or lower case
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS transactions_txn_hash ON transactions (lower(txn_hash))")
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS transactions_order ON transactions (store, order_number)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS transactions_unexported ON transactions (id) WHERE exported = 0")
+        self._db.execute("CREATE INDEX IF NOT EXISTS transactions_unverified ON transactions (id) WHERE txn_status != 'Approved'")
+        self._db.execute("CREATE INDEX IF NOT EXISTS transactions_unpromoted ON transactions (id) "
+                         "WHERE txn_status = 'Approved' AND promoted = 0")
+        self._lock = threading.Lock()
+
+    # False if the hash or the order is already in the ledger
+    def record(self, store, order_number, txn_hash, network=None, wallet_address=None, order_total=None,
+               trm=None, order_total_usd=None, total_with_commission=None, date=None):
+        date = date or time.strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            with self._lock:
+                self._db.execute(
+                    "INSERT INTO transactions (date, store, order_number, order_total, trm, order_total_usd, "
+                    "total_with_commission, txn_hash, network, wallet_address) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (date, store, str(order_number), order_total, trm, order_total_usd, total_with_commission,
+                     txn_hash.strip(), network, wallet_address)
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    # The payment a hash was already used for, or None
+    def find_hash(self, txn_hash):
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(SHEET_COLUMNS)} FROM transactions WHERE lower(txn_hash) = lower(?)",
+                (txn_hash.strip(),)
+            ).fetchone()
+        return dict(zip(SHEET_COLUMNS, row)) if row else None
+
+    # Oldest payments not yet in the worksheet, as (id, row dict)
+    def unexported(self, limit=50):
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, {', '.join(SHEET_COLUMNS)} FROM transactions WHERE exported = 0 ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [(row[0], dict(zip(SHEET_COLUMNS, row[1:]))) for row in rows]
+
+    # first_row is where the worksheet put the first of these rows, if known
+    def mark_exported(self, ids, first_row=None):
+        with self._lock:
+            self._db.executemany(
+                "UPDATE transactions SET exported = 1, sheet_row = ? WHERE id = ?",
+                [(first_row + offset if first_row else None, row_id) for offset, row_id in enumerate(sorted(ids))]
+            )
+
+    # Payments whose transaction has not been confirmed on chain yet
+    def unverified(self):
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, sheet_row, {', '.join(SHEET_COLUMNS)} FROM transactions WHERE txn_status != 'Approved' ORDER BY id"
+            ).fetchall()
+        return [dict(zip(['id', 'sheet_row'] + SHEET_COLUMNS, row)) for row in rows]
+
+    def set_status(self, ids, txn_status):
+        with self._lock:
+            self._db.executemany("UPDATE transactions SET txn_status = ? WHERE id = ?", [(txn_status, row_id) for row_id in ids])
+
+    # Approved payments whose order the store has not marked as paid yet
+    def unpromoted(self):
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, sheet_row, {', '.join(SHEET_COLUMNS)} FROM transactions "
+                "WHERE txn_status = 'Approved' AND promoted = 0 ORDER BY id"
+            ).fetchall()
+        return [dict(zip(['id', 'sheet_row'] + SHEET_COLUMNS, row)) for row in rows]
+
+    def mark_promoted(self, ids):
+        with self._lock:
+            self._db.executemany("UPDATE transactions SET promoted = 1 WHERE id = ?", [(row_id,) for row_id in ids])
+
+    # Bring in rows that so far only exist in the worksheet (header + values
+    # as read from it). Rows with a hash or order already in the ledger are
+    # skipped. Returns how many were added.
+    def import_rows(self, header, rows, first_row=2):
+        columns = [SHEET_HEADERS.get(name, name) for name in header]
+        added = 0
+        with self._lock, self._transaction():
+            for row_index, values in enumerate(rows, start=first_row):
+                record = {column: value for column, value in zip(columns, values) if column in SHEET_COLUMNS}
+                if not record.get('txn_hash') or not record.get('order_number'):
+                    continue
+                record.setdefault('date', '')
+                record.setdefault('store', '')
+                names = list(record)
+                # Orders approved in the worksheet were already promoted back then
+                cursor = self._db.execute(
+                    f"INSERT OR IGNORE INTO transactions ({', '.join(names)}, exported, sheet_row, promoted) "
+                    f"VALUES ({', '.join('?' for _ in names)}, 1, ?, ?)",
+                    [record[name] for name in names] + [row_index, int(record.get('txn_status') == 'Approved')]
+                )
+                added += cursor.rowcount
+        return added
+
+    @contextmanager
+    def _transaction(self):
+        self._db.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+
+# Row number where append_rows put the first row, from its "updatedRange"
+# (e.g. "Transacciones!A12:K14" -> 12)
+def first_appended_row(response):
+    updated_range = (response or {}).get('updates', {}).get('updatedRange', '')
+    match = re.search(r"![A-Z]+(\d+)", updated_range)
+    return int(match.group(1)) if match else None
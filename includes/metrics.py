@@ -0,0 +1,235 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = ['%s="%s"' % (name, _escape(value)) for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+state_transitions = registry.counter(
+    "kiris_state_transitions_total",
+    "Conversation state transitions",
+    ("from_state", "to_state")
+)
+state_transition_seconds = registry.histogram(
+    "kiris_state_transition_seconds",
+    "Time spent handling an update, by the state transition it caused",
+    ("from_state", "to_state")
+)
+external_call_seconds = registry.histogram(
+    "kiris_external_call_seconds",
+    "Latency of calls to external services",
+    ("dependency", "operation", "outcome")
+)
+cache_requests = registry.counter(
+    "kiris_cache_requests_total",
+    "Cache lookups",
+    ("cache", "result")
+)
+
+
+# Time a call to an external service:
+#     with observe("woocommerce", "get_order"):
+#         ...
+@contextmanager
+def observe(dependency, operation):
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        external_call_seconds.observe(time.perf_counter() - start, dependency, operation, outcome)
+
+
+# A chat without a conversation in progress has state None
+def observe_transition(from_state, to_state, seconds):
+    from_state = from_state or "IDLE"
+    to_state = to_state or "IDLE"
+    state_transitions.inc(from_state, to_state)
+    state_transition_seconds.observe(seconds, from_state, to_state)
+
+
+def cache_lookup(cache, hit):
+    cache_requests.inc(cache, "hit" if hit else "miss")
+
+
+# Opt-in sampling profiler: a thread looks at the main thread's stack every
+# `interval` seconds and counts each stack it sees. The result is in the
+# collapsed format flamegraph tools read ("a;b;c count").
+class SamplingProfiler:
+    def __init__(self, interval=0.01, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.main_thread().ident
+        self._stacks = _Tally()
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True, name="sampling-profiler").start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            with self._lock:
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def render(self):
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+
+profiler = None
+
+# Readiness for the orchestrator: set once updates are being received
+# (polling started or webhook listening), cleared when shutting down
+ready = threading.Event()
+
+
+# Polling mode: ready as soon as every application and its updater are running
+async def mark_ready_when_polling(*applications):
+    while not all(application.running and application.updater.running for application in applications):
+        await asyncio.sleep(0.05)
+    ready.set()
+
+
+def start_profiler(interval):
+    global profiler
+    profiler = SamplingProfiler(interval)
+    profiler.start()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/ready":
+            if not ready.is_set():
+                self.send_error(503, "Not ready")
+                return
+            body = "ok\n"
+        elif self.path == "/metrics":
+            body = registry.render()
+        elif self.path == "/debug/profile" and profiler is not None:
+            body = profiler.render()
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve /metrics, /ready (and /debug/profile when profiling) from a background thread
+def start_metrics_server(port, address="127.0.0.1"):
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    return server
+
+
+# Batch jobs write their metrics to a file for node_exporter's textfile collector
+def write_textfile(path):
+    with open(f"{path}.tmp", "w") as f:
+        f.write(registry.render())
+    os.replace(f"{path}.tmp", path)
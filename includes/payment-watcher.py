@@ -0,0 +1,270 @@
+from collections import defaultdict
+from decimal import Decimal
+import requests
+import os
+import sys
+import time
+from woocommerce import API
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from includes.ledger import Ledger
+from includes.payments import PendingPayments
+from includes.ratelimit import RateLimiter
+from includes.metrics import observe, start_metrics_server
+from includes.resilience import CircuitOpenError, Dependency
+from includes.stores import load_store_configs, open_store
+from includes.verifiers import ACCEPTED_TOKENS
+
+# Vigila las billeteras de recepción y confirma las órdenes pendientes cuyo pago
+# llega, sin esperar a que el cliente envíe el hash. Una consulta paginada por
+# billetera en cada vuelta, en lugar de una por hash.
+load_dotenv()
+
+TRONSCAN_API_URL = 'https://apilist.tronscan.org/api/'
+TRONSCAN_API_KEY = os.getenv('TRONSCAN_API_KEY', '')
+ETH_API_URL = 'https://api.etherscan.io/api/'
+ETH_API_KEY = os.getenv('ETHERSCAN_API_KEY', '')
+
+WALLET_ADDRESS_TRON = os.getenv('WALLET_ADDRESS_TRON', '')
+WALLET_ADDRESS_ETH = os.getenv('WALLET_ADDRESS_ETH', '')
+
+WATCH_INTERVAL = float(os.getenv('WATCH_INTERVAL', '15'))
+PAYMENT_WINDOW = int(os.getenv('PAYMENT_WINDOW', '86400'))  # Segundos que una cotización sigue vigente
+PAGE_SIZE = 50
+MAX_PAGES = 20
+
+payments = PendingPayments(os.getenv('PAYMENTS_DB', '../payments.db'))
+
+# El mismo ledger que los bots: los pagos que llegan sin hash del cliente también se registran
+ledger = Ledger(os.getenv('LEDGER_DB', '../ledger.db'))
+
+tronscan_limiter = RateLimiter(float(os.getenv('TRONSCAN_RPS', '5')))
+etherscan_limiter = RateLimiter(float(os.getenv('ETHERSCAN_RPS', '5')))
+http = requests.Session()
+
+# Reintentos y circuito abierto si el explorador deja de responder
+EXPLORER_TIMEOUT = float(os.getenv('EXPLORER_TIMEOUT', '10'))
+tronscan = Dependency('tronscan', timeout=EXPLORER_TIMEOUT)
+etherscan = Dependency('etherscan', timeout=EXPLORER_TIMEOUT)
+
+# Cada intento cuenta para el límite de peticiones por segundo
+def explorer_get(dependency, limiter, url, **kwargs):
+    def send(timeout):
+        limiter.acquire()
+        return http.get(url, timeout=timeout, **kwargs)
+    return dependency.request_sync(send, idempotent=True)
+
+# Tiendas y billeteras: las de STORES_FILE (ver stores.example.json), como en
+# kiris.py; sin él, la tienda de WC_API_URL y las billeteras de WALLET_ADDRESS_*
+STORES_FILE = os.getenv('STORES_FILE', '')
+WC_API_URL=os.getenv('WC_API_URL', '')
+
+if STORES_FILE:
+    store_configs = load_store_configs(STORES_FILE)
+else:
+    store_configs = [{
+        'name': 'woocommerce',
+        'platform': 'woocommerce',
+        'url': WC_API_URL,
+        'consumer_key': os.getenv('WC_CONSUMER_KEY', ''),
+        'consumer_secret': os.getenv('WC_CONSUMER_SECRET', ''),
+        'bot': '',
+        'wallets': {'TRON': WALLET_ADDRESS_TRON, 'ETH': WALLET_ADDRESS_ETH},
+    }]
+stores = [open_store(config) for config in store_configs]
+
+# Las órdenes de WooCommerce se pasan a 'processing' al llegar el pago; las de
+# Shopify las promueve txn-validation.py
+woocommerce_stores = [
+    (store, API(
+        url=config['url'],
+        consumer_key=config['consumer_key'],
+        consumer_secret=config['consumer_secret'],
+        version=config.get('version', 'wc/v3'),
+        timeout=10
+    ))
+    for store, config in zip(stores, store_configs)
+    if config['platform'] == 'woocommerce' and config['url']
+]
+
+def same_store(store, url):
+    normalize = lambda value: value.replace('https://', '').replace('http://', '').rstrip('/').lower()
+    return bool(url) and normalize(store) == normalize(url)
+
+# Transferencias TRC20 entrantes desde la marca de tiempo `cursor` (ms)
+def tron_transfers(wallet_address, cursor):
+    since = int(cursor) if cursor else int((time.time() - PAYMENT_WINDOW) * 1000)
+    transfers = []
+    for page in range(MAX_PAGES):
+        with observe('tronscan', 'token_trc20/transfers'):
+            data = explorer_get(tronscan, tronscan_limiter, f'{TRONSCAN_API_URL}token_trc20/transfers', params={
+                'toAddress': wallet_address,
+                'start_timestamp': since,
+                'limit': PAGE_SIZE,
+                'start': page * PAGE_SIZE,
+                'confirm': 'true',
+            }, headers={'TRON-PRO-API-KEY': TRONSCAN_API_KEY}).json()
+        batch = data.get('token_transfers', [])
+        for transfer in batch:
+            if transfer.get('to_address') != wallet_address or transfer.get('contract_address') not in ACCEPTED_TOKENS['TRON']:
+                continue
+            if transfer.get('finalResult', 'SUCCESS') != 'SUCCESS':
+                continue
+            decimals = int(transfer.get('tokenInfo', {}).get('tokenDecimal', 6))
+            transfers.append({
+                'hash': transfer['transaction_id'],
+                'amount': Decimal(transfer['quant']) / (10 ** decimals),
+                'timestamp': transfer['block_ts'] / 1000,
+                'cursor': transfer['block_ts'],
+            })
+        if len(batch) < PAGE_SIZE:
+            break
+    return transfers
+
+# Transferencias ERC20 entrantes desde el bloque `cursor`
+def eth_transfers(wallet_address, cursor):
+    start_block = int(cursor) if cursor else 0
+    oldest = time.time() - PAYMENT_WINDOW
+    transfers = []
+    for page in range(1, MAX_PAGES + 1):
+        with observe('etherscan', 'tokentx'):
+            data = explorer_get(etherscan, etherscan_limiter, ETH_API_URL, params={
+                'module': 'account',
+                'action': 'tokentx',
+                'address': wallet_address,
+                'startblock': start_block,
+                'endblock': 99999999,
+                'page': page,
+                'offset': PAGE_SIZE,
+                'sort': 'asc' if cursor else 'desc',
+                'apikey': ETH_API_KEY,
+            }).json()
+        batch = data.get('result') if isinstance(data.get('result'), list) else []
+        for transfer in batch:
+            if transfer['to'].lower() != wallet_address.lower() or transfer['contractAddress'].lower() not in ACCEPTED_TOKENS['ETH']:
+                continue
+            if not cursor and int(transfer['timeStamp']) < oldest:
+                continue
+            transfers.append({
+                'hash': transfer['hash'],
+                'amount': Decimal(transfer['value']) / (10 ** int(transfer['tokenDecimal'])),
+                'timestamp': int(transfer['timeStamp']),
+                'cursor': int(transfer['blockNumber']),
+            })
+        # Sin punto de partida basta con la primera página (las más recientes)
+        if len(batch) < PAGE_SIZE or not cursor:
+            break
+    return transfers
+
+# Una consulta por billetera, aunque varias tiendas la compartan. Sólo TRON y ETH
+# tienen consulta de transferencias; los pagos en otras redes llegan con hash.
+fetchers = {
+    'TRON': tron_transfers,
+    'ETH': eth_transfers,
+}
+wallets = sorted({
+    (network, address)
+    for store in stores
+    for network, address in store.wallet_addresses.items()
+    if address and network in fetchers
+})
+
+def cents(amount):
+    return int((Decimal(str(amount)) * 100).to_integral_value())
+
+# Índices de los pagos pendientes: por hash informado y por (red, billetera, monto)
+def build_index(pending):
+    by_hash = {payment['txn_hash'].lower(): payment for payment in pending if payment['txn_hash']}
+    by_amount = defaultdict(list)
+    for payment in pending:
+        by_amount[(payment['network'], payment['wallet_address'], cents(payment['amount']))].append(payment)
+    return by_hash, by_amount
+
+def match(network, wallet_address, transfer, by_hash, by_amount):
+    payment = by_hash.get(transfer['hash'].lower())
+    if payment is not None:
+        if transfer['amount'] < Decimal(str(payment['amount'])):
+            print(f"Pago incompleto para la orden {payment['order_number']}: {transfer['amount']} de {payment['amount']}")
+            return None
+        return payment
+
+    # Sin hash, el monto sólo identifica la orden si ninguna otra espera el mismo valor
+    candidates = [
+        payment for payment in by_amount.get((network, wallet_address, cents(transfer['amount'])), [])
+        if payment['created'] <= transfer['timestamp'] and payment['txn_hash'] is None
+    ]
+    if len(candidates) > 1:
+        print(f"Transferencia {transfer['hash']} de {transfer['amount']} coincide con {len(candidates)} órdenes, se deja para revisión")
+        return None
+    return candidates[0] if candidates else None
+
+def confirm(payment, network, txn_hash, amount=None):
+    payments.mark_paid(payment['store'], payment['order_number'], txn_hash, amount)
+    print(f"Pago confirmado: orden {payment['order_number']} ({payment['store']}), {network} {txn_hash}")
+
+    # Si el cliente ya había enviado el hash, el bot lo registró y esto no hace nada. El
+    # SheetsWriter del bot exporta las filas nuevas del ledger en su siguiente vuelta
+    # (este proceso no puede despertarlo) y txn-validation.py las aprueba y promueve.
+    ledger.record(
+        payment['store'],
+        payment['order_number'],
+        txn_hash,
+        network=network,
+        wallet_address=payment['wallet_address'],
+        order_total=payment['order_total'],
+        trm=payment['trm'],
+        order_total_usd=payment['order_total_usd'] if payment['order_total_usd'] is not None else payment['amount'],
+        total_with_commission=payment['total_with_commission']
+    )
+
+    wcapi = next((wcapi for store, wcapi in woocommerce_stores if same_store(payment['store'], store.key)), None)
+    if wcapi is not None:
+        try:
+            with observe('woocommerce', 'update_order'):
+                response = wcapi.put(f"orders/{payment['order_number']}", {
+                    'status': 'processing',
+                    'meta_data': [
+                        {'key': 'txn_hash', 'value': txn_hash},
+                        {'key': 'network', 'value': network},
+                    ]
+                })
+        except requests.RequestException as e:
+            print(f"No se pudo actualizar la orden {payment['order_number']} en WooCommerce: {e}")
+            return
+        if not response.ok:
+            print(f"No se pudo actualizar la orden {payment['order_number']} en WooCommerce: {response.status_code} {response.text[:200]}")
+
+def watch_once():
+    pending = payments.pending(since=time.time() - PAYMENT_WINDOW)
+    by_hash, by_amount = build_index(pending)
+
+    for network, wallet_address in wallets:
+        cursor = payments.get_cursor(wallet_address)
+        try:
+            transfers = fetchers[network](wallet_address, cursor)
+        except (requests.RequestException, CircuitOpenError, ValueError, KeyError) as e:
+            print(f"No se pudieron consultar las transferencias de {network}: {e}")
+            continue
+
+        for transfer in transfers:
+            payment = match(network, wallet_address, transfer, by_hash, by_amount)
+            if payment is None:
+                continue
+            confirm(payment, network, transfer['hash'], transfer['amount'])
+            # Un pago confirmado no puede volver a coincidir en esta vuelta
+            by_hash.pop((payment['txn_hash'] or '').lower(), None)
+            same_amount = by_amount[(payment['network'], payment['wallet_address'], cents(payment['amount']))]
+            if payment in same_amount:
+                same_amount.remove(payment)
+
+        if transfers:
+            payments.set_cursor(wallet_address, max(transfer['cursor'] for transfer in transfers))
+
+if os.getenv('METRICS_PORT'):
+    start_metrics_server(int(os.getenv('METRICS_PORT')), os.getenv('METRICS_ADDRESS', '127.0.0.1'))
+
+print('Vigilando billeteras...')
+while True:
+    watch_once()
+    time.sleep(WATCH_INTERVAL)
@@ -0,0 +1,108 @@
+import sqlite3
+import threading
+import time
+
+
+# Payments the bot is waiting for, shared between the bot (which records the
+# quote when the customer picks a network) and the payment watcher (which
+# matches incoming transfers against them). SQLite in WAL mode so both
+# processes can use the same file.
+class PendingPayments:
+    ADDED_COLUMNS = [
+        ('received_amount', 'REAL'),
+        ('order_total', 'TEXT'),
+        ('trm', 'REAL'),
+        ('order_total_usd', 'REAL'),
+        ('total_with_commission', 'REAL'),
+    ]
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS pending_payments (
+                store TEXT NOT NULL,
+                order_number TEXT NOT NULL,
+                network TEXT NOT NULL,
+                wallet_address TEXT NOT NULL,
+                amount REAL NOT NULL,
+                chat_id INTEGER,
+                created REAL NOT NULL,
+                txn_hash TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                received_amount REAL,
+                order_total TEXT,
+                trm REAL,
+                order_total_usd REAL,
+                total_with_commission REAL,
+                PRIMARY KEY (store, order_number)
+            )
+        """)
+        # Databases from before the watcher recorded the amount it saw and the quote details
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(pending_payments)")}
+        for name, kind in self.ADDED_COLUMNS:
+            if name not in columns:
+                self._db.execute(f"ALTER TABLE pending_payments ADD COLUMN {name} {kind}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS pending_payments_status ON pending_payments (status, network)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS watcher_state (wallet_address TEXT PRIMARY KEY, cursor TEXT)")
+        self._lock = threading.Lock()
+
+    # A new quote replaces an older unpaid one for the same order. The quote
+    # details (order total, TRM, USD totals) let the watcher record a payment
+    # it matched without a hash in the ledger.
+    def add(self, store, order_number, network, wallet_address, amount, chat_id=None, order_total=None, trm=None,
+            order_total_usd=None, total_with_commission=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO pending_payments (store, order_number, network, wallet_address, amount, chat_id, created, "
+                "order_total, trm, order_total_usd, total_with_commission) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (store, order_number) DO UPDATE SET network = excluded.network, "
+                "wallet_address = excluded.wallet_address, amount = excluded.amount, chat_id = excluded.chat_id, "
+                "created = excluded.created, order_total = excluded.order_total, trm = excluded.trm, "
+                "order_total_usd = excluded.order_total_usd, total_with_commission = excluded.total_with_commission, "
+                "txn_hash = NULL WHERE status = 'pending'",
+                (store, str(order_number), network, wallet_address, float(amount), chat_id, time.time(),
+                 None if order_total is None else str(order_total), trm, order_total_usd, total_with_commission)
+            )
+
+    # The hash the customer says they paid with, if they sent one
+    def set_hash(self, store, order_number, txn_hash):
+        with self._lock:
+            self._db.execute(
+                "UPDATE pending_payments SET txn_hash = ? WHERE store = ? AND order_number = ? AND status = 'pending'",
+                (txn_hash, store, str(order_number))
+            )
+
+    def pending(self, since=0):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT store, order_number, network, wallet_address, amount, chat_id, created, txn_hash, "
+                "order_total, trm, order_total_usd, total_with_commission "
+                "FROM pending_payments WHERE status = 'pending' AND created >= ?",
+                (since,)
+            ).fetchall()
+        keys = ('store', 'order_number', 'network', 'wallet_address', 'amount', 'chat_id', 'created', 'txn_hash',
+                'order_total', 'trm', 'order_total_usd', 'total_with_commission')
+        return [dict(zip(keys, row)) for row in rows]
+
+    # received_amount is what the transfer actually carried, for reconciliation
+    def mark_paid(self, store, order_number, txn_hash, received_amount=None):
+        with self._lock:
+            self._db.execute(
+                "UPDATE pending_payments SET status = 'paid', txn_hash = ?, received_amount = ? WHERE store = ? AND order_number = ?",
+                (txn_hash, None if received_amount is None else float(received_amount), store, str(order_number))
+            )
+
+    # Where the watcher left off for each wallet (a timestamp or block number)
+    def get_cursor(self, wallet_address):
+        with self._lock:
+            row = self._db.execute("SELECT cursor FROM watcher_state WHERE wallet_address = ?", (wallet_address,)).fetchone()
+        return row[0] if row else None
+
+    def set_cursor(self, wallet_address, cursor):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO watcher_state (wallet_address, cursor) VALUES (?, ?)",
+                (wallet_address, str(cursor))
+            )
@@ -0,0 +1,84 @@
+import requests
+
+from includes.metrics import observe
+
+
+# Orders per request: WooCommerce's orders/batch accepts up to 100. Each
+# Shopify orderMarkAsPaid costs 10 points of a 1000 point query budget, so
+# 25 per request leaves room for the rest of the bucket.
+WOOCOMMERCE_BATCH_SIZE = 100
+SHOPIFY_BATCH_SIZE = 25
+
+ORDER_MARK_AS_PAID = "{alias}: orderMarkAsPaid(input: ${alias}) {{ order {{ id }} userErrors {{ field message }} }}"
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+# Move paid orders to `status` with WooCommerce's orders/batch endpoint.
+# "Paid" means a verifier saw the amount due reach our wallet in an accepted
+# token (see verifiers.py), not just a successful transaction hash.
+# Returns {order_number: error} for the orders that were not updated.
+def promote_woocommerce(wcapi, order_numbers, status='processing', batch_size=WOOCOMMERCE_BATCH_SIZE):
+    failed = {}
+    for batch in chunks([str(order_number) for order_number in order_numbers], batch_size):
+        try:
+            with observe('woocommerce', 'orders/batch'):
+                response = wcapi.post('orders/batch', {'update': [{'id': order_number, 'status': status} for order_number in batch]})
+                response.raise_for_status()
+            results = response.json().get('update', [])
+        except (requests.RequestException, ValueError) as e:
+            failed.update({order_number: str(e) for order_number in batch})
+            continue
+
+        # One result per order, in the same order; failed ones carry an "error"
+        for order_number, result in zip(batch, results):
+            if 'error' in result:
+                failed[order_number] = result['error'].get('message', result['error'])
+        failed.update({order_number: 'sin respuesta' for order_number in batch[len(results):]})
+    return failed
+
+
+# Shopify has no batch REST endpoint for orders; the GraphQL Admin API runs
+# several orderMarkAsPaid mutations (one alias per order) in one request.
+# Returns {order_number: error} like promote_woocommerce.
+def promote_shopify(http, shop_domain, access_token, order_numbers, version='2023-10', batch_size=SHOPIFY_BATCH_SIZE):
+    shop_domain = shop_domain.replace('https://', '').replace('http://', '').rstrip('/')
+    url = f'https://{shop_domain}/admin/api/{version}/graphql.json'
+    failed = {}
+
+    valid = []
+    for order_number in order_numbers:
+        if str(order_number).isdigit():
+            valid.append(str(order_number))
+        else:
+            failed[str(order_number)] = 'número de orden inválido'
+
+    for batch in chunks(valid, batch_size):
+        aliases = {f'o{index}': order_number for index, order_number in enumerate(batch)}
+        query = 'mutation({}) {{ {} }}'.format(
+            ', '.join(f'${alias}: OrderMarkAsPaidInput!' for alias in aliases),
+            ' '.join(ORDER_MARK_AS_PAID.format(alias=alias) for alias in aliases)
+        )
+        variables = {alias: {'id': f'gid://shopify/Order/{order_number}'} for alias, order_number in aliases.items()}
+        try:
+            with observe('shopify', 'orderMarkAsPaid'):
+                response = http.post(url, json={'query': query, 'variables': variables},
+                                     headers={'X-Shopify-Access-Token': access_token}, timeout=30)
+                response.raise_for_status()
+            body = response.json()
+        except (requests.RequestException, ValueError) as e:
+            failed.update({order_number: str(e) for order_number in batch})
+            continue
+
+        data = body.get('data') or {}
+        errors = '; '.join(error.get('message', '') for error in body.get('errors', []))
+        for alias, order_number in aliases.items():
+            result = data.get(alias)
+            if result is None:
+                failed[order_number] = errors or 'sin respuesta'
+            elif result.get('userErrors'):
+                failed[order_number] = '; '.join(error['message'] for error in result['userErrors'])
+    return failed
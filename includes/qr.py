@@ -0,0 +1,49 @@
+import io
+import threading
+
+
+def render_qr(data):
+    import qrcode  # Only needed the first time each wallet's QR is sent
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill='black', back_color='white')
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+# QR codes for the receiving wallets, each rendered the first time it is
+# needed. After the first upload Telegram gives us a file_id for the photo,
+# and later sends reuse it instead of uploading the PNG again.
+class WalletQRCodes:
+    def __init__(self, wallet_addresses):
+        self._addresses = {network: address for network, address in wallet_addresses.items() if address}
+        self._png = {}
+        self._file_ids = {}
+        self._lock = threading.Lock()
+
+    # What to pass as `photo` to send_photo: the cached file_id if we have
+    # one, otherwise the PNG bytes
+    def photo(self, network):
+        file_id = self._file_ids.get(network)
+        if file_id:
+            return file_id
+        png = self._png.get(network)
+        if png is None:
+            png = self._png[network] = render_qr(self._addresses[network])
+        return png
+
+    def remember(self, network, message):
+        if message is None or not message.photo or network in self._file_ids:
+            return
+        with self._lock:
+            # Telegram returns several sizes, the last one is the original
+            self._file_ids.setdefault(network, message.photo[-1].file_id)
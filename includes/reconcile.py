@@ -0,0 +1,211 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from includes.ledger import SHEET_COLUMNS
+
+# Conciliación del ledger contra lo que vio el vigilante de pagos. Todo se
+# calcula por columnas con pandas (sin recorrer filas), así un año de
+# historia toma segundos. Desde includes/, como los demás scripts:
+#
+#   python reconcile.py --xlsx conciliacion.xlsx --parquet reportes/ --since 2024-01-01
+#
+# El xlsx trae el resumen diario y sólo las filas que requieren revisión; el
+# detalle completo va a parquet.
+
+load_dotenv()
+
+LEDGER_DB = os.getenv('LEDGER_DB', '../ledger.db')
+PAYMENTS_DB = os.getenv('PAYMENTS_DB', '../payments.db')
+
+# Diferencia en USD por debajo de la cual un pago se considera completo
+TOLERANCE = float(os.getenv('RECONCILE_TOLERANCE', '0.01'))
+
+NUMERIC_COLUMNS = ['order_total', 'trm', 'order_total_usd', 'total_with_commission']
+
+
+def load_ledger(path):
+    with sqlite3.connect(path) as db:
+        ledger = pd.read_sql_query(f"SELECT id, {', '.join(SHEET_COLUMNS)} FROM transactions", db)
+
+    # Filas importadas de la hoja traen texto donde el bot guarda números
+    for column in NUMERIC_COLUMNS:
+        ledger[column] = pd.to_numeric(ledger[column], errors='coerce')
+    dates = pd.to_datetime(ledger['date'], format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    other = dates.isna() & ledger['date'].fillna('').ne('')
+    if other.any():
+        dates[other] = pd.to_datetime(ledger.loc[other, 'date'], format='mixed', errors='coerce')
+    ledger['date'] = dates
+    ledger['order_number'] = ledger['order_number'].astype(str)
+    ledger['hash_key'] = ledger['txn_hash'].fillna('').str.strip().str.lower()
+    return ledger
+
+
+# Cotizaciones y pagos confirmados por payment-watcher.py; vacío si no se usa
+def load_payments(path):
+    columns = ['store', 'order_number', 'created', 'quoted_usd', 'payment_status', 'paid_hash', 'received_usd']
+    if not os.path.exists(path):
+        payments = pd.DataFrame(columns=columns)
+    else:
+        with sqlite3.connect(path) as db:
+            payments = pd.read_sql_query(
+                "SELECT store, order_number, created, amount, status, txn_hash, received_amount FROM pending_payments", db
+            )
+        payments.columns = columns
+    # Hora local, como las fechas del ledger
+    local = datetime.now().astimezone().tzinfo
+    payments['created'] = pd.to_datetime(payments['created'], unit='s', utc=True).dt.tz_convert(local).dt.tz_localize(None)
+    payments['order_number'] = payments['order_number'].astype(str)
+    payments['paid_key'] = payments['paid_hash'].fillna('').str.strip().str.lower()
+    return payments
+
+
+# Una fila por transacción del ledger con lo esperado, lo recibido y el resultado
+def reconcile(ledger, payments):
+    df = ledger.merge(
+        payments[['store', 'order_number', 'quoted_usd', 'payment_status', 'paid_key', 'received_usd']],
+        on=['store', 'order_number'],
+        how='left'
+    )
+
+    df['expected_usd'] = df['total_with_commission'].fillna(df['order_total_usd'])
+    paid = df['payment_status'].eq('paid')
+    df['received_usd'] = df['received_usd'].where(paid)
+    df['difference_usd'] = df['received_usd'] - df['expected_usd']
+    df['commission_usd'] = (df['total_with_commission'] - df['order_total_usd']).fillna(0)
+
+    # La TRM de cada cotización contra la mediana del día, y la que implican los montos
+    df['day'] = df['date'].dt.normalize()
+    df['implied_trm'] = df['order_total'] / df['order_total_usd'].replace(0, np.nan)
+    df['trm_drift_pct'] = (df['trm'] / df.groupby('day')['trm'].transform('median') - 1) * 100
+
+    df['reconciliation'] = np.select(
+        [
+            df['payment_status'].isna(),
+            paid & df['paid_key'].ne('') & df['paid_key'].ne(df['hash_key']),
+            df['received_usd'].isna(),
+            df['difference_usd'] < -TOLERANCE,
+            df['difference_usd'] > TOLERANCE,
+        ],
+        ['sin cotización', 'hash distinto', 'sin confirmar', 'incompleto', 'excedente'],
+        'completo'
+    )
+    return df.drop(columns=['paid_key'])
+
+
+# Hashes que reclama más de un pedido, entre el ledger y los pagos que confirmó
+# el vigilante (el ledger solo ya no admite repetidos), y pagos confirmados
+# que no están en el ledger
+def hash_anomalies(ledger, payments):
+    confirmed = payments['payment_status'].eq('paid') & payments['paid_key'].ne('')
+    claims = pd.concat([
+        ledger.loc[ledger['hash_key'].ne(''), ['store', 'order_number', 'txn_hash', 'hash_key']].assign(source='ledger'),
+        payments.loc[confirmed, ['store', 'order_number', 'paid_hash', 'paid_key']]
+            .set_axis(['store', 'order_number', 'txn_hash', 'hash_key'], axis=1).assign(source='payments'),
+    ], ignore_index=True)
+    claims = claims.drop_duplicates(['store', 'order_number', 'hash_key'])
+    duplicates = claims[claims['hash_key'].duplicated(keep=False)].sort_values('hash_key')
+    # isin sobre object: con el tipo string de pandas 3 es varias veces más lento
+    orphans = payments[confirmed & ~payments['paid_key'].astype(object).isin(ledger['hash_key'].astype(object))]
+    return duplicates.drop(columns=['hash_key']), orphans.drop(columns=['paid_key'])
+
+
+def daily_summary(df):
+    flags = df.assign(
+        approved=df['txn_status'].eq('Approved'),
+        complete=df['reconciliation'].eq('completo'),
+        short=df['reconciliation'].eq('incompleto'),
+        unconfirmed=df['reconciliation'].isin(['sin confirmar', 'sin cotización']),
+        trm_drift_abs=df['trm_drift_pct'].abs(),
+    )
+    return flags.groupby(['day', 'store'], as_index=False).agg(
+        transactions=('id', 'size'),
+        approved=('approved', 'sum'),
+        complete=('complete', 'sum'),
+        short=('short', 'sum'),
+        unconfirmed=('unconfirmed', 'sum'),
+        order_total_cop=('order_total', 'sum'),
+        expected_usd=('expected_usd', 'sum'),
+        received_usd=('received_usd', 'sum'),
+        difference_usd=('difference_usd', 'sum'),
+        commission_usd=('commission_usd', 'sum'),
+        trm_mean=('trm', 'mean'),
+        trm_drift_max_pct=('trm_drift_abs', 'max'),
+    )
+
+
+# Filas por revisar en el xlsx (openpyxl escribe celda por celda, así que sólo
+# van éstas). Las que no tienen cotización, de antes del vigilante o de tiendas
+# que no lo usan, quedan en el resumen y en el parquet.
+REVIEW = ['hash distinto', 'sin confirmar', 'incompleto', 'excedente']
+REVIEW_COLUMNS = ['date', 'store', 'order_number', 'network', 'txn_hash', 'txn_status', 'trm',
+                  'expected_usd', 'received_usd', 'difference_usd', 'reconciliation']
+
+
+def export_xlsx(path, summary, df, duplicates, orphans):
+    review = df.loc[df['reconciliation'].isin(REVIEW), REVIEW_COLUMNS]
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        summary.to_excel(writer, sheet_name='Resumen diario', index=False)
+        review.to_excel(writer, sheet_name='Por revisar', index=False)
+        duplicates.to_excel(writer, sheet_name='Hashes duplicados', index=False)
+        orphans.to_excel(writer, sheet_name='Pagos sin ledger', index=False)
+
+
+def export_parquet(directory, summary, df, duplicates, orphans):
+    os.makedirs(directory, exist_ok=True)
+    summary.to_parquet(os.path.join(directory, 'daily_summary.parquet'), index=False)
+    df.to_parquet(os.path.join(directory, 'transactions.parquet'), index=False)
+    duplicates.to_parquet(os.path.join(directory, 'duplicate_hashes.parquet'), index=False)
+    orphans.astype({'quoted_usd': float, 'received_usd': float}).to_parquet(os.path.join(directory, 'orphan_payments.parquet'), index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Conciliación del ledger de pagos')
+    parser.add_argument('--ledger', default=LEDGER_DB)
+    parser.add_argument('--payments', default=PAYMENTS_DB)
+    parser.add_argument('--since', help='fecha inicial (AAAA-MM-DD)')
+    parser.add_argument('--until', help='fecha final, inclusive (AAAA-MM-DD)')
+    parser.add_argument('--xlsx', help='archivo xlsx con el resumen diario y las filas por revisar')
+    parser.add_argument('--parquet', help='directorio para el detalle y el resumen en parquet')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    ledger = load_ledger(args.ledger)
+    if args.since:
+        ledger = ledger[ledger['date'] >= pd.Timestamp(args.since)]
+    if args.until:
+        ledger = ledger[ledger['date'] < pd.Timestamp(args.until) + pd.Timedelta(days=1)]
+    payments = load_payments(args.payments)
+    if args.since:
+        payments = payments[payments['created'] >= pd.Timestamp(args.since)]
+    if args.until:
+        payments = payments[payments['created'] < pd.Timestamp(args.until) + pd.Timedelta(days=1)]
+
+    df = reconcile(ledger, payments)
+    duplicates, orphans = hash_anomalies(ledger, payments)
+    summary = daily_summary(df)
+
+    if args.xlsx:
+        export_xlsx(args.xlsx, summary, df, duplicates, orphans)
+    if args.parquet:
+        export_parquet(args.parquet, summary, df, duplicates, orphans)
+
+    counts = df['reconciliation'].value_counts()
+    print(f"{len(df)} transacciones, {summary['day'].nunique()} días ({time.perf_counter() - started:.2f}s)")
+    print(f"Esperado: {df['expected_usd'].sum():,.2f} USD, recibido: {df['received_usd'].sum():,.2f} USD, "
+          f"comisiones: {df['commission_usd'].sum():,.2f} USD")
+    for name, count in counts.items():
+        print(f"  {name}: {count}")
+    print(f"Hashes duplicados: {duplicates['txn_hash'].str.lower().nunique()}, pagos sin ledger: {len(orphans)}")
+
+
+if __name__ == '__main__':
+    main()
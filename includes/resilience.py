@@ -0,0 +1,214 @@
+import asyncio
+import contextvars
+import functools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from includes.metrics import registry
+
+
+# Responses worth retrying and counted as failures by the circuit breaker
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+resilience_events = registry.counter(
+    "kiris_resilience_events_total",
+    "Retries, hedged requests and circuit breaker changes",
+    ("dependency", "event")
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name):
+        super().__init__(f"{name} no está disponible (circuito abierto)")
+        self.name = name
+
+
+# What a handler can get from a degraded upstream, see with_deadline()
+UPSTREAM_ERRORS = (DeadlineExceeded, CircuitOpenError, httpx.HTTPError)
+
+
+# Absolute time (time.monotonic) by which the current update must be done.
+# Set per task by deadline(); None means no budget.
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    current = _deadline.get()
+    new = time.monotonic() + seconds
+    token = _deadline.set(new if current is None else min(current, new))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+# Timeout for the next call: the dependency's own timeout, cut down to
+# what is left of the deadline
+def budget(timeout):
+    current = _deadline.get()
+    if current is None:
+        return timeout
+    remaining = current - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Se agotó el tiempo para atender la solicitud")
+    return min(timeout, remaining)
+
+
+# Run a handler with a deadline for its external calls. If an upstream is
+# down or too slow, on_error(update, error) answers the customer instead of
+# the update failing silently.
+def with_deadline(handler, seconds, on_error):
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        try:
+            with deadline(seconds):
+                return await handler(update, context)
+        except UPSTREAM_ERRORS as e:
+            await on_error(update, e)
+    return wrapper
+
+
+# Closed: calls go through. After failure_threshold consecutive failures it
+# opens and calls fail immediately for reset_timeout seconds; then one trial
+# call is let through (half open) and its result closes or reopens it.
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def check(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._trial:
+                self._trial = True
+                return
+        raise CircuitOpenError(self.name)
+
+    def success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                resilience_events.inc(self.name, "circuit_closed")
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    # The trial call ended without an answer either way (e.g. cancelled)
+    def abandon(self):
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened_at is None and self._failures >= self.failure_threshold):
+                if self._opened_at is None:
+                    resilience_events.inc(self.name, "circuit_opened")
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+# Timeout, retries and circuit breaker for one upstream service. `send`
+# receives the timeout to use and performs the request. Only idempotent
+# requests are retried (with jittered exponential backoff); with
+# hedge_after, a second identical request is started if the first has not
+# answered by then and whichever answers first is used.
+class Dependency:
+    def __init__(self, name, timeout=10, retries=2, backoff=0.25, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+
+    async def request(self, send, idempotent=False, hedge_after=None):
+        attempts = self.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            timeout = budget(self.timeout)
+            self.breaker.check()
+            try:
+                if hedge_after is not None and idempotent and hedge_after < timeout:
+                    response = await self._hedged(send, timeout, hedge_after)
+                else:
+                    response = await send(timeout)
+            except httpx.TransportError:
+                self.breaker.failure()
+                if attempt == attempts - 1:
+                    raise
+            except BaseException:
+                self.breaker.abandon()
+                raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS:
+                    self.breaker.success()
+                    return response
+                self.breaker.failure()
+                if attempt == attempts - 1:
+                    return response
+            resilience_events.inc(self.name, "retry")
+            await asyncio.sleep(min(self._backoff(attempt), budget(self.timeout)))
+
+    # Same as request() for blocking clients (requests), which raise OSError
+    # subclasses on connection errors and timeouts
+    def request_sync(self, send, idempotent=False):
+        attempts = self.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            timeout = budget(self.timeout)
+            self.breaker.check()
+            try:
+                response = send(timeout)
+            except OSError:
+                self.breaker.failure()
+                if attempt == attempts - 1:
+                    raise
+            except BaseException:
+                self.breaker.abandon()
+                raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS:
+                    self.breaker.success()
+                    return response
+                self.breaker.failure()
+                if attempt == attempts - 1:
+                    return response
+            resilience_events.inc(self.name, "retry")
+            time.sleep(min(self._backoff(attempt), budget(self.timeout)))
+
+    def _backoff(self, attempt):
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    async def _hedged(self, send, timeout, hedge_after):
+        first = asyncio.ensure_future(send(timeout))
+        pending = {first}
+        error = None
+        try:
+            done, _ = await asyncio.wait(pending, timeout=hedge_after)
+            if done:
+                return first.result()
+
+            resilience_events.inc(self.name, "hedged")
+            pending.add(asyncio.ensure_future(send(timeout - hedge_after)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
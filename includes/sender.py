@@ -0,0 +1,131 @@
+import asyncio
+from collections import deque
+
+from telegram.error import RetryAfter, TelegramError
+
+from includes.metrics import observe
+from includes.ratelimit import AsyncRateLimiter
+
+
+# Telegram limits for a single message
+MAX_TEXT_LENGTH = 4096
+MAX_CAPTION_LENGTH = 1024
+
+
+class OutgoingMessage:
+    __slots__ = ('photo', 'text', 'kwargs', 'on_sent')
+
+    def __init__(self, text=None, photo=None, kwargs=None, on_sent=None):
+        self.text = text
+        self.photo = photo
+        self.kwargs = kwargs or {}
+        self.on_sent = on_sent
+
+
+class ChatOutbox:
+    __slots__ = ('pending', 'task', 'next_send')
+
+    def __init__(self):
+        self.pending = deque()
+        self.task = None
+        self.next_send = 0.0
+
+
+# Outgoing messages go through here instead of straight to context.bot.
+# Each chat has its own queue, drained at most once per per_chat_interval
+# seconds, and every send also takes a token from a global bucket
+# (~30 msg/s). Messages that pile up while a chat waits for its turn are
+# merged: consecutive texts become one message and texts following a photo
+# become its caption. A RetryAfter from Telegram pauses only that chat.
+class Outbox:
+    def __init__(self, bot, per_chat_interval=1.0, global_rate=30):
+        self.bot = bot
+        self.per_chat_interval = per_chat_interval
+        self._global = AsyncRateLimiter(global_rate)
+        self._chats = {}
+
+    def send_message(self, chat_id, text, **kwargs):
+        self._enqueue(chat_id, OutgoingMessage(text=text, kwargs=kwargs))
+
+    # on_sent receives the sent Message, e.g. to keep the photo's file_id
+    def send_photo(self, chat_id, photo, caption=None, on_sent=None, **kwargs):
+        self._enqueue(chat_id, OutgoingMessage(text=caption, photo=photo, kwargs=kwargs, on_sent=on_sent))
+
+    # Wait until everything queued so far has been sent
+    async def close(self):
+        tasks = [chat.task for chat in self._chats.values() if chat.task is not None]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _enqueue(self, chat_id, message):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = ChatOutbox()
+        chat.pending.append(message)
+        if chat.task is None:
+            chat.task = asyncio.get_running_loop().create_task(self._drain(chat_id, chat))
+
+    async def _drain(self, chat_id, chat):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                delay = chat.next_send - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if not chat.pending:
+                    break
+
+                message = coalesce(chat.pending)
+                await self._global.acquire()
+                try:
+                    sent = await self._deliver(chat_id, message)
+                except RetryAfter as e:
+                    chat.pending.appendleft(message)
+                    chat.next_send = loop.time() + e.retry_after
+                    continue
+                except TelegramError as e:
+                    print(f"No se pudo enviar el mensaje al chat {chat_id}: {e}")
+                    sent = None
+
+                chat.next_send = loop.time() + self.per_chat_interval
+                if sent is not None and message.on_sent is not None:
+                    message.on_sent(sent)
+        finally:
+            # Nothing left for this chat and its interval has passed, forget it
+            # until it gets a new message
+            del self._chats[chat_id]
+
+    async def _deliver(self, chat_id, message):
+        if message.photo is not None:
+            with observe("telegram", "send_photo"):
+                return await self.bot.send_photo(chat_id=chat_id, photo=message.photo, caption=message.text, **message.kwargs)
+        with observe("telegram", "send_message"):
+            return await self.bot.send_message(chat_id=chat_id, text=message.text, **message.kwargs)
+
+
+# Take the next message from the queue, folding in as many of the following
+# ones as Telegram allows. Only a keyboard can be carried over: a message with
+# reply_markup ends the group, and anything with other options (parse_mode,
+# a callback) is sent on its own.
+def coalesce(pending):
+    first = pending.popleft()
+    if first.kwargs:
+        return first
+
+    limit = MAX_CAPTION_LENGTH if first.photo is not None else MAX_TEXT_LENGTH
+    parts = [first.text] if first.text else []
+    kwargs = {}
+    while pending:
+        candidate = pending[0]
+        if candidate.photo is not None or candidate.on_sent is not None or set(candidate.kwargs) - {'reply_markup'}:
+            break
+        if len("\n\n".join(parts + [candidate.text])) > limit:
+            break
+        pending.popleft()
+        parts.append(candidate.text)
+        if candidate.kwargs:
+            kwargs = candidate.kwargs
+            break
+
+    if parts == ([first.text] if first.text else []):
+        return first
+    return OutgoingMessage(text="\n\n".join(parts), photo=first.photo, kwargs=kwargs, on_sent=first.on_sent)
@@ -0,0 +1,209 @@
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from includes.metrics import observe_transition
+
+
+# Per-chat conversation state. __slots__ keeps each session at a few hundred
+# bytes so thousands of open conversations fit comfortably in one process.
+class Session:
+    __slots__ = (
+        'chat_id',
+        'state',
+        'store',
+        'order_number',
+        'crypto_choice',
+        'wallet_address',
+        'transaction_hash',
+        'order_total',
+        'trm_value',
+        'order_total_usd',
+        'total_with_commission',
+        'touched',
+        'loaded_state',
+        'loaded_at',
+    )
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.touched = time.monotonic()
+        self.reset()
+        self.loaded()
+
+    # Remember the state the handler started from, to measure the transition on save
+    def loaded(self):
+        self.loaded_state = self.state
+        self.loaded_at = time.monotonic()
+
+    def record_transition(self, to_state):
+        observe_transition(self.loaded_state, to_state, time.monotonic() - self.loaded_at)
+        self.loaded_state = to_state
+        self.loaded_at = time.monotonic()
+
+    # Forget everything about the current payment but keep the chat
+    def reset(self):
+        self.state = None
+        self.store = None
+        self.order_number = None
+        self.crypto_choice = None
+        self.wallet_address = None
+        self.transaction_hash = None
+        self.order_total = None
+        self.trm_value = None
+        self.order_total_usd = None
+        self.total_with_commission = None
+
+
+# Interface of the session backends. Handlers get() the session for a chat,
+# change it and save() it; drop() forgets a finished conversation. Both
+# record the state transition in the metrics.
+class SessionBackend(ABC):
+    @abstractmethod
+    def get(self, chat_id):
+        pass
+
+    @abstractmethod
+    def save(self, session):
+        pass
+
+    @abstractmethod
+    def drop(self, session):
+        pass
+
+
+# In-process sessions keyed by chat_id. The OrderedDict is kept in last-used order, so
+# expired chats are always at the front and eviction never scans the rest.
+class SessionStore(SessionBackend):
+    def __init__(self, ttl=1800, max_sessions=10000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chat_id):
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get(chat_id)
+            if session is None:
+                session = Session(chat_id)
+                self._sessions[chat_id] = session
+            else:
+                self._sessions.move_to_end(chat_id)
+            session.touched = now
+        session.loaded()
+        return session
+
+    # Sessions are live objects here, nothing to write back
+    def save(self, session):
+        session.record_transition(session.state)
+
+    def drop(self, session):
+        session.record_transition("FINISHED")
+        with self._lock:
+            self._sessions.pop(session.chat_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    # Drop abandoned chats (idle longer than ttl) and, if still over the
+    # limit, the least recently used ones
+    def _evict(self, now):
+        sessions = self._sessions
+        while sessions:
+            chat_id, session = next(iter(sessions.items()))
+            if now - session.touched < self.ttl and len(sessions) < self.max_sessions:
+                break
+            sessions.popitem(last=False)
+
+
+# Sessions stored in SQLite (WAL mode), so several bot processes on the same
+# host, or a restarted one, pick up a conversation where it was left. With
+# shards > 1 chats are spread over several database files by chat_id, which
+# spreads SQLite's single-writer lock.
+class SQLiteSessionStore(SessionBackend):
+    FIELDS = [name for name in Session.__slots__ if name not in ('chat_id', 'touched', 'loaded_state', 'loaded_at')]
+
+    def __init__(self, path, ttl=1800, shards=1, evict_interval=60):
+        self.ttl = ttl
+        self.evict_interval = evict_interval
+        self._last_evict = 0.0
+        if shards > 1:
+            base, ext = os.path.splitext(path)
+            paths = [f"{base}-{i}{ext}" for i in range(shards)]
+        else:
+            paths = [path]
+        self._shards = [self._connect(shard_path) for shard_path in paths]
+        self._lock = threading.Lock()
+
+    def _connect(self, path):
+        db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        # Columns without a declared type keep the Python value as stored
+        columns = ", ".join(self.FIELDS)
+        db.execute(f"CREATE TABLE IF NOT EXISTS sessions (chat_id INTEGER PRIMARY KEY, {columns}, touched REAL)")
+        # Databases created before a field was added get the column now
+        existing = {row[1] for row in db.execute("PRAGMA table_info(sessions)")}
+        for name in self.FIELDS:
+            if name not in existing:
+                db.execute(f"ALTER TABLE sessions ADD COLUMN {name}")
+        db.execute("CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched)")
+        return db
+
+    def _shard(self, chat_id):
+        return self._shards[chat_id % len(self._shards)]
+
+    def get(self, chat_id):
+        self._evict()
+        session = Session(chat_id)
+        columns = ", ".join(self.FIELDS)
+        with self._lock:
+            row = self._shard(chat_id).execute(
+                f"SELECT {columns} FROM sessions WHERE chat_id = ? AND touched > ?",
+                (chat_id, time.time() - self.ttl)
+            ).fetchone()
+        if row is not None:
+            for name, value in zip(self.FIELDS, row):
+                setattr(session, name, value)
+        session.loaded()
+        return session
+
+    def save(self, session):
+        session.record_transition(session.state)
+        columns = ", ".join(self.FIELDS)
+        placeholders = ", ".join("?" for _ in self.FIELDS)
+        values = [getattr(session, name) for name in self.FIELDS]
+        with self._lock:
+            self._shard(session.chat_id).execute(
+                f"INSERT OR REPLACE INTO sessions (chat_id, {columns}, touched) VALUES (?, {placeholders}, ?)",
+                [session.chat_id, *values, time.time()]
+            )
+
+    def drop(self, session):
+        session.record_transition("FINISHED")
+        with self._lock:
+            self._shard(session.chat_id).execute("DELETE FROM sessions WHERE chat_id = ?", (session.chat_id,))
+
+    # Delete abandoned chats now and then rather than on every call
+    def _evict(self):
+        now = time.time()
+        if now - self._last_evict < self.evict_interval:
+            return
+        self._last_evict = now
+        with self._lock:
+            for db in self._shards:
+                db.execute("DELETE FROM sessions WHERE touched <= ?", (now - self.ttl,))
+
+
+# Build the session backend selected in the configuration ('memory' or 'sqlite')
+def open_session_store(backend='memory', path='sessions.db', ttl=1800, max_sessions=10000, shards=1):
+    if backend == 'sqlite':
+        return SQLiteSessionStore(path, ttl=ttl, shards=shards)
+    if backend == 'memory':
+        return SessionStore(ttl=ttl, max_sessions=max_sessions)
+    raise ValueError(f"Unknown session backend: {backend}")
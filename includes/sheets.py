@@ -0,0 +1,121 @@
+import asyncio
+import random
+
+from includes.ledger import SHEET_COLUMNS, first_appended_row
+from includes.metrics import observe
+
+
+# Status codes worth retrying: quota exceeded and transient server errors
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+
+# gspread and oauth2client are slow to import, so they are only loaded (in a
+# worker thread) when the first row is exported. Without a timeout a hung
+# request would stall the export forever.
+def authorize(credentials_file, timeout=None):
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
+    credentials = ServiceAccountCredentials.from_json_keyfile_name(credentials_file, SCOPE)
+    client = gspread.authorize(credentials)
+    if timeout is not None:
+        client.set_timeout(timeout)
+    return client
+
+
+# Background export of the ledger to the "Transacciones" worksheet.
+# Handlers record payments in the Ledger and call notify(); this task waits
+# flush_interval so a burst is grouped, then appends every row not yet
+# exported in batches of batch_size. Rows stay unexported until Google
+# accepts them, so a failed write or a restart only delays the export.
+# `columns` picks which ledger columns make up a worksheet row. Without a
+# gspread `client` one is authorized from credentials_file on first use.
+class SheetsWriter:
+    def __init__(self, spreadsheet_key, worksheet_name, ledger, credentials_file="credentials.json", client=None,
+                 columns=SHEET_COLUMNS, batch_size=50, flush_interval=2.0, retry_interval=60, max_retries=5, timeout=30):
+        self.client = client
+        self.credentials_file = credentials_file
+        self.spreadsheet_key = spreadsheet_key
+        self.worksheet_name = worksheet_name
+        self.ledger = ledger
+        self.columns = columns
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._worksheet = None
+        self._wakeup = None
+        self._closing = False
+        self._task = None
+
+    # A payment was recorded, export it soon
+    def notify(self):
+        self._wakeup.set()
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()  # Export whatever a previous run left behind
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    # Export what is left and stop
+    async def close(self):
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.retry_interval)
+            except asyncio.TimeoutError:
+                pass
+            if not self._closing:
+                await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            await self._export()
+
+    async def _export(self):
+        while True:
+            pending = self.ledger.unexported(self.batch_size)
+            if not pending:
+                return
+            rows = [[record[column] for column in self.columns] for _, record in pending]
+            response = await self._write(rows)
+            if response is None:
+                return  # Retried on the next round
+            self.ledger.mark_exported([row_id for row_id, _ in pending], first_appended_row(response))
+            if len(pending) < self.batch_size:
+                return
+
+    async def _write(self, rows):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with observe("sheets", "append_rows"):
+                    worksheet = await self._get_worksheet()
+                    response = await asyncio.to_thread(worksheet.append_rows, rows)
+                print(f"Se guardaron {len(rows)} transacciones en la hoja {self.worksheet_name}")
+                return response or {}
+            except Exception as e:
+                # gspread's APIError carries the HTTP response; anything else
+                # (auth, network) is left for the next round
+                status_code = getattr(getattr(e, "response", None), "status_code", None)
+                if status_code not in RETRYABLE_STATUS or attempt == self.max_retries:
+                    print(f"No se pudieron guardar {len(rows)} transacciones en Google Sheets: {e}")
+                    return None
+                # Exponential backoff with jitter, the write quota resets every minute
+                await asyncio.sleep(min(60, 2 ** attempt) + random.random())
+
+    # Open the spreadsheet once and keep the worksheet handle
+    async def _get_worksheet(self):
+        if self._worksheet is None:
+            if self.client is None:
+                self.client = await asyncio.to_thread(authorize, self.credentials_file, self.timeout)
+            sheet = await asyncio.to_thread(self.client.open_by_key, self.spreadsheet_key)
+            self._worksheet = await asyncio.to_thread(sheet.worksheet, self.worksheet_name)
+        return self._worksheet
@@ -0,0 +1,104 @@
+import base64
+import hashlib
+import hmac
+import json
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+from includes.metrics import registry
+
+
+store_webhooks = registry.counter(
+    "kiris_store_webhooks_total",
+    "Order webhooks received from the stores",
+    ("store", "topic", "result")
+)
+
+
+# Receives order webhooks from the store and puts the order in the client's
+# OrderCache (api.prewarm), so when the customer writes to the bot minutes
+# later the quote needs no request to the store. The body is authenticated
+# with the store's HMAC-SHA256 signature (base64) of the raw body.
+class StoreWebhookHandler(tornado.web.RequestHandler):
+    store = None
+    signature_header = None
+    topic_header = None
+    topics = ()
+
+    def initialize(self, api, secret, ttl=None):
+        self.api = api
+        self.secret = secret.encode("utf-8")
+        self.ttl = ttl
+
+    def post(self):
+        topic = self.request.headers.get(self.topic_header)
+        if topic is None:
+            # WooCommerce checks a new webhook with an unsigned "webhook_id=N" ping
+            self.set_status(200)
+            return
+
+        signature = self.request.headers.get(self.signature_header, "")
+        expected = base64.b64encode(hmac.new(self.secret, self.request.body, hashlib.sha256).digest()).decode()
+        if not hmac.compare_digest(signature, expected):
+            store_webhooks.inc(self.store, topic, "rejected")
+            raise tornado.web.HTTPError(401)
+
+        if topic not in self.topics:
+            store_webhooks.inc(self.store, topic, "ignored")
+            self.set_status(200)
+            return
+
+        try:
+            order = json.loads(self.request.body)
+            self.api.prewarm(order, self.ttl)
+        except (ValueError, KeyError, TypeError):
+            store_webhooks.inc(self.store, topic, "invalid")
+            raise tornado.web.HTTPError(400)
+        store_webhooks.inc(self.store, topic, "cached")
+        self.set_status(200)
+
+
+class WooCommerceWebhookHandler(StoreWebhookHandler):
+    store = "woocommerce"
+    signature_header = "X-WC-Webhook-Signature"
+    topic_header = "X-WC-Webhook-Topic"
+    topics = ("order.created", "order.updated")
+
+
+class ShopifyWebhookHandler(StoreWebhookHandler):
+    store = "shopify"
+    signature_header = "X-Shopify-Hmac-Sha256"
+    topic_header = "X-Shopify-Topic"
+    topics = ("orders/create", "orders/updated")
+
+
+HANDLERS = {
+    "woocommerce": WooCommerceWebhookHandler,
+    "shopify": ShopifyWebhookHandler,
+}
+
+
+# Listen for store webhooks on the bot's event loop (call from post_init),
+# next to polling or the Telegram webhook. Each store gets /<url_path>/<name>
+# (a single store also /<url_path>) and is verified with its own secret.
+# Returns the server, to stop() it at shutdown.
+def start_store_webhooks(stores, port, listen="0.0.0.0", url_path="store", ttl=None):
+    url_path = url_path.strip('/')
+    routes = []
+    for store in stores:
+        if not store.webhook_secret:
+            print(f"La tienda {store.name} no tiene secreto para los webhooks, no se reciben sus órdenes")
+            continue
+        options = dict(api=store.backend, secret=store.webhook_secret, ttl=ttl)
+        handler = HANDLERS[store.backend.platform]
+        routes.append((rf"/{url_path}/{store.name}/?", handler, options))
+        if len(stores) == 1:
+            routes.append((rf"/{url_path}/?", handler, options))
+    if not routes:
+        raise ValueError("Los webhooks de la tienda necesitan un secreto para verificar las firmas")
+
+    server = HTTPServer(tornado.web.Application(routes))
+    server.listen(port, address=listen)
+    print(f"Webhooks de las tiendas en {listen}:{port}/{url_path}")
+    return server
@@ -0,0 +1,150 @@
+import json
+import math
+import os
+
+from includes.commerce import ShopifyAPI, WooCommerceAPI
+from includes.qr import WalletQRCodes
+
+
+# Networks without a label show up by name
+NETWORK_LABELS = {
+    'TRON': 'TRON (TRC20)',
+    'ETH': 'ETH (ERC20)',
+    'BSC': 'BSC (BEP20)',
+    'POLYGON': 'Polygon (PoS)',
+}
+
+DEFAULT_NOTICE = "Por favor, ten en cuenta que sólo aceptamos USDT o USDC. NO ENVIAR UN TOKEN DIFERENTE."
+COMMISSION_NOTICE = "Se ha agregado un porcentaje mínimo de comisión al monto total para cubrir los costos de monetización."
+
+
+# One store served by the bot: its commerce backend plus what the
+# conversation needs to quote it. `key` identifies the store in the ledger
+# and the pending payments (the store URL or shop domain, as before);
+# `prefix` selects it from a deep link ("/start <prefix>-<order>") when a bot
+# serves several stores.
+class Store:
+    def __init__(self, name, backend, key, bot, wallet_addresses, networks=None, commission=0, decimals=2,
+                 notice=DEFAULT_NOTICE, command='start', prefix=None, webhook_secret=''):
+        self.name = name
+        self.backend = backend
+        self.key = key
+        self.bot = bot
+        self.wallet_addresses = wallet_addresses
+        self.networks = networks or [network for network, address in wallet_addresses.items() if address]
+        self.commission = commission
+        self.decimals = decimals
+        self.notice = notice
+        self.command = command
+        self.prefix = prefix or name
+        self.webhook_secret = webhook_secret
+        self.wallet_qr_codes = WalletQRCodes(wallet_addresses)
+
+    # Order total in USD at the given TRM, and with the commission (None without one)
+    def quote(self, order_total, trm):
+        amount_usd = float(order_total) / trm
+        order_total_usd = round(amount_usd, self.decimals) if self.decimals else round(amount_usd)
+        if not self.commission:
+            return order_total_usd, None
+        return order_total_usd, math.ceil(round(order_total_usd * (1 + self.commission / 100), 2))
+
+    # What the customer has to send
+    def amount_due(self, session):
+        return session.total_with_commission if session.total_with_commission is not None else session.order_total_usd
+
+
+# Build a store from its configuration (see stores.example.json). The
+# backends share `pool` (connections) and `cache` (orders).
+def open_store(config, pool=None, cache=None, timeout=10, hedge_after=None):
+    platform = config['platform']
+    timeout = float(config.get('timeout', timeout))
+    hedge_after = config.get('hedge_after', hedge_after)
+    if platform == 'woocommerce':
+        backend = WooCommerceAPI(
+            url=config['url'],
+            consumer_key=config['consumer_key'],
+            consumer_secret=config['consumer_secret'],
+            version=config.get('version', 'wc/v3'),
+            timeout=timeout,
+            cache=cache,
+            hedge_after=hedge_after,
+            pool=pool
+        )
+        key = config['url']
+    elif platform == 'shopify':
+        backend = ShopifyAPI(
+            config['shop_domain'],
+            config['api_key'],
+            config['api_password'],
+            version=config.get('version', '2023-10'),
+            timeout=timeout,
+            cache=cache,
+            hedge_after=hedge_after,
+            pool=pool
+        )
+        key = config['shop_domain']
+    else:
+        raise ValueError(f"Unknown store platform: {platform}")
+
+    return Store(
+        config['name'],
+        backend,
+        key,
+        config['bot'],
+        config.get('wallets', {}),
+        networks=config.get('networks'),
+        commission=float(config.get('commission') or 0),
+        decimals=int(config.get('decimals', 2)),
+        notice=config.get('notice', DEFAULT_NOTICE),
+        command=config.get('command', 'start'),
+        prefix=config.get('prefix'),
+        webhook_secret=config.get('webhook_secret', '')
+    )
+
+
+# Store configurations from a JSON file: a list of objects. String values can
+# reference environment variables ("${WC_CONSUMER_SECRET}"), so the file
+# itself holds no secrets.
+def load_store_configs(path):
+    with open(path) as f:
+        configs = json.load(f)
+    return [
+        {name: os.path.expandvars(value) if isinstance(value, str) else value for name, value in config.items()}
+        for config in configs
+    ]
+
+
+# The stores of every bot in the process
+class StoreRegistry:
+    def __init__(self, stores):
+        self._stores = {}
+        self._bots = {}
+        for store in stores:
+            if store.name in self._stores:
+                raise ValueError(f"Duplicate store name: {store.name}")
+            self._stores[store.name] = store
+            self._bots.setdefault(store.bot, []).append(store)
+
+    def __iter__(self):
+        return iter(self._stores.values())
+
+    def __len__(self):
+        return len(self._stores)
+
+    def get(self, name):
+        return self._stores.get(name)
+
+    # Bot token -> its stores, the first one being the bot's default
+    def by_bot(self):
+        return dict(self._bots)
+
+    # The store and order number for what a customer sent to `bot`: a
+    # "<prefix>-<order>" picks that store, anything else is an order of
+    # `default` (or of the bot's first store)
+    def resolve(self, bot, text, default=None):
+        stores = self._bots[bot]
+        if text:
+            for store in stores:
+                if text.startswith(f"{store.prefix}-"):
+                    return store, text[len(store.prefix) + 1:]
+        return default or stores[0], text
@@ -0,0 +1,85 @@
+import asyncio
+import contextvars
+import time
+
+import httpx
+
+from includes.metrics import observe
+from includes.resilience import CircuitOpenError, DeadlineExceeded, Dependency
+
+
+TRM_URL = "https://www.datos.gov.co/resource/mcec-87by.json"
+
+
+# Process-wide cache for the TRM (COP per USD). The rate only changes once a
+# day, so quotes read it from memory; a background refresh runs shortly
+# before it expires and the last good value keeps being served while the
+# upstream is slow or down.
+class TRMCache:
+    def __init__(self, ttl=3600, refresh_ahead=300, timeout=5, url=TRM_URL):
+        self.ttl = ttl
+        self.refresh_ahead = min(refresh_ahead, ttl)
+        self.url = url
+        self.timeout = timeout
+        self.dependency = Dependency("trm", timeout=timeout)
+        self._client = None
+        self._value = None
+        self._fetched_at = 0.0
+        self._refresh_task = None
+        self._lock = asyncio.Lock()
+
+    async def get(self):
+        if self._value is None:
+            # Nothing to serve yet, the first callers have to wait for the API
+            async with self._lock:
+                # The startup refresh may already be on its way
+                if self._value is None and self._refresh_task is not None and not self._refresh_task.done():
+                    await asyncio.shield(self._refresh_task)
+                if self._value is None:
+                    self._store(await self._fetch())
+            return self._value
+
+        age = time.monotonic() - self._fetched_at
+        if age >= self.ttl - self.refresh_ahead:
+            self.refresh_in_background()
+        return self._value
+
+    async def refresh(self):
+        try:
+            self._store(await self._fetch())
+        except (httpx.HTTPError, DeadlineExceeded, CircuitOpenError, LookupError, ValueError) as e:
+            print(f"No se pudo actualizar la TRM, se usa el último valor ({self._value}): {e}")
+
+    # In a fresh context: the refresh must not inherit the deadline of the
+    # update that happened to trigger it
+    def refresh_in_background(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.get_running_loop().create_task(self.refresh(), context=contextvars.Context())
+
+    async def aclose(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        return self._client
+
+    def _store(self, value):
+        self._value = value
+        self._fetched_at = time.monotonic()
+
+    # Only the latest row is needed, not the whole dataset
+    async def _fetch(self):
+        params = {"$order": "vigenciadesde DESC", "$limit": 1}
+        with observe("trm", "fetch"):
+            response = await self.dependency.request(
+                lambda timeout: self.client.get(self.url, params=params, timeout=timeout),
+                idempotent=True
+            )
+            response.raise_for_status()
+        data = response.json()
+        return float(data[0]["valor"])
@@ -1,37 +1,121 @@
 import gspread
+from gspread.utils import rowcol_to_a1
 from oauth2client.service_account import ServiceAccountCredentials
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
 import requests
 import os
+import sys
 from woocommerce import API
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from includes.ledger import Ledger
+from includes.metrics import write_textfile
+from includes.resilience import CircuitOpenError
+from includes.promotion import chunks, promote_shopify, promote_woocommerce
+from includes.stores import load_store_configs, open_store
+from includes.verifiers import VerifierRegistry, load_verifier_configs, open_verifier
+
 # Inicio del bot
 load_dotenv()
 
-# Configuración de la API de Tron Scan
-TRONSCAN_API_URL = 'https://apilist.tronscan.org/api/'
-TRONSCAN_API_KEY = '41a1fbc9-d4a2-4ed2-9631-1ca59f116044'
-
-# Configuración de la API de ETH
-ETH_API_URL = 'https://api.etherscan.io/api/'
-ETH_API_KEY = 'R98YJP93QSWF2R2H38HDT2WSKKWDXJXH56'
+# Redes soportadas: con VERIFIERS_FILE (ver verifiers.example.json) se
+# configura cada una; sin él, TRON y ETH se consultan por JSON-RPC si hay URL
+# del nodo y, si no, en TronScan y Etherscan como antes.
+VERIFIERS_FILE = os.getenv('VERIFIERS_FILE', '')
+TRON_RPC_URL = os.getenv('TRON_RPC_URL', '')
+ETH_RPC_URL = os.getenv('ETH_RPC_URL', '')
+TRONSCAN_API_KEY = os.getenv('TRONSCAN_API_KEY', '')
+ETHERSCAN_API_KEY = os.getenv('ETHERSCAN_API_KEY', '')
 
 # Configuración de Google Sheets
 GSPREAD_API_KEY='1k4n7XgcWMuZc14qMRDeJnxFHDwCcmArk6LnL6k25fqY'
 WORKSHEET_NAME = 'Transacciones'
 
+# Ledger local con las transacciones registradas por los bots
+LEDGER_DB = os.getenv('LEDGER_DB', '../ledger.db')
+
 # Configuración de Woocommerce
 WC_API_URL=os.getenv('WC_API_URL', '')
 WC_CONSUMER_KEY=os.getenv('WC_CONSUMER_KEY', '')
 WC_CONSUMER_SECRET=os.getenv('WC_CONSUMER_SECRET', '')
 
-# Configurar la API de WooCommerce
-wcapi = API(
-    url=WC_API_URL,
-    consumer_key=WC_CONSUMER_KEY,
-    consumer_secret=WC_CONSUMER_SECRET,
-    version="wc/v3"
-)
+# Configuración de Shopify (las mismas variables que usa kiris-shopify.py)
+SHOP_DOMAIN=os.getenv('SHOP_DOMAIN', '')
+SHOPIFY_ACCESS_TOKEN=os.getenv('API_PASSWORD', '')
+
+# Tiendas cuyas órdenes se promueven: las de STORES_FILE (ver stores.example.json),
+# como en kiris.py; sin él, la de WC_API_URL y la de SHOP_DOMAIN como antes
+STORES_FILE = os.getenv('STORES_FILE', '')
+
+# Concurrencia de la validación y límites de peticiones por explorador
+VALIDATION_WORKERS = int(os.getenv('VALIDATION_WORKERS', '16'))
+TRONSCAN_RPS = float(os.getenv('TRONSCAN_RPS', '5'))
+ETHERSCAN_RPS = float(os.getenv('ETHERSCAN_RPS', '5'))
+
+# Conexiones HTTP reutilizadas entre hilos
+http = requests.Session()
+http.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=VALIDATION_WORKERS))
+
+# Reintentos y circuito abierto si el explorador o el nodo dejan de responder
+EXPLORER_TIMEOUT = float(os.getenv('EXPLORER_TIMEOUT', '10'))
+
+if VERIFIERS_FILE:
+    verifier_configs = load_verifier_configs(VERIFIERS_FILE)
+else:
+    verifier_configs = [
+        {'network': 'TRON', 'type': 'jsonrpc', 'rpc_url': TRON_RPC_URL} if TRON_RPC_URL else
+        {'network': 'TRON', 'type': 'tronscan', 'api_key': TRONSCAN_API_KEY, 'rps': TRONSCAN_RPS},
+        {'network': 'ETH', 'type': 'jsonrpc', 'rpc_url': ETH_RPC_URL} if ETH_RPC_URL else
+        {'network': 'ETH', 'type': 'etherscan', 'api_key': ETHERSCAN_API_KEY, 'rps': ETHERSCAN_RPS},
+    ]
+verifiers = VerifierRegistry(open_verifier(config, http, timeout=EXPLORER_TIMEOUT) for config in verifier_configs)
+
+if STORES_FILE:
+    store_configs = load_store_configs(STORES_FILE)
+else:
+    store_configs = []
+    if WC_API_URL:
+        store_configs.append({'name': 'woocommerce', 'platform': 'woocommerce', 'url': WC_API_URL,
+                              'consumer_key': WC_CONSUMER_KEY, 'consumer_secret': WC_CONSUMER_SECRET, 'bot': ''})
+    if SHOP_DOMAIN:
+        store_configs.append({'name': 'shopify', 'platform': 'shopify', 'shop_domain': SHOP_DOMAIN,
+                              'api_key': '', 'api_password': SHOPIFY_ACCESS_TOKEN, 'bot': ''})
+
+# Cada tienda con la función que pasa sus órdenes a pagadas, por lotes. Las
+# promociones son síncronas: WooCommerce con la API de woocommerce y Shopify por GraphQL.
+def promoter(config):
+    if config['platform'] == 'woocommerce':
+        wcapi = API(
+            url=config['url'],
+            consumer_key=config['consumer_key'],
+            consumer_secret=config['consumer_secret'],
+            version=config.get('version', 'wc/v3')
+        )
+        return lambda orders: promote_woocommerce(wcapi, orders)
+    return lambda orders: promote_shopify(http, config['shop_domain'], config['api_password'], orders,
+                                          version=config.get('version', '2023-10'))
+
+stores = [(open_store(config), promoter(config)) for config in store_configs]
+
+# Lo que el cliente debía enviar: el total con comisión, si la hubo
+def amount_due(record):
+    value = record['total_with_commission'] or record['order_total_usd']
+    try:
+        return Decimal(str(value)) if value not in (None, '') else None
+    except InvalidOperation:
+        return None
+
+# Hashes confirmados de un lote de transacciones de la misma red (ninguno si falló la consulta):
+# la transacción debe llevar el monto en un token aceptado a la billetera de la orden
+def verify(batch):
+    verifier, records = batch
+    try:
+        return verifier.verify([dict(record, amount=amount_due(record)) for record in records])
+    except (requests.RequestException, CircuitOpenError, ValueError) as e:
+        print(f"No se pudieron verificar {len(records)} transacciones {verifier.network}: {e}")
+        return set()
 
 # Conexión a Google Sheets
 scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
@@ -42,50 +126,88 @@ client = gspread.authorize(credentials)
 spreadsheet = client.open_by_key(GSPREAD_API_KEY)
 worksheet = spreadsheet.worksheet(WORKSHEET_NAME)
 
-# Obtener los registros del archivo de Excel
-records = worksheet.get_all_records()
+ledger = Ledger(LEDGER_DB)
+
+# Las filas que sólo existen en la hoja (anteriores al ledger) se importan una vez con LEDGER_IMPORT=1
+if os.getenv('LEDGER_IMPORT'):
+    values = worksheet.get_all_values()
+    imported = ledger.import_rows(values[0], values[1:])
+    print(f'Se importaron {imported} transacciones de la hoja {WORKSHEET_NAME} al ledger.')
 
-# Filtrar las transacciones no aprobadas
-unapproved_records = [record for record in records if record['txn_status'] != 'Approved']
+# Las transacciones pendientes salen del ledger, sin leer la hoja
+unapproved_records = ledger.unverified()
 
-# Iterar sobre las transacciones no aprobadas y actualizar su estado
+# Sin billetera o sin monto no se puede comprobar que el pago cubre la orden: esas
+# transacciones no se aprueban ni sus órdenes se pasan a 'processing', quedan para revisión manual
+verifiable = []
 for record in unapproved_records:
-    txn_hash = record['txn_hash']
-    network = record['network']
-
-    txn_status = None
-
-    if network == 'TRON':
-        # Consultar el estado de la transacción en Tron Scan
-        url = f'{TRONSCAN_API_URL}transaction-info?hash={txn_hash}&apiKey={TRONSCAN_API_KEY}'
-        response = requests.get(url)
-        data = response.json()
-
-        if 'confirmed' in data and data['confirmed']:
-            txn_status = 'Approved'
-        else:
-            continue  # Saltar la actualización si la transacción no está confirmada
-
-    elif network == 'ETH':
-        # Consultar el estado de la transacción en la API de ETH
-        url = f'{ETH_API_URL}?module=transaction&action=gettxreceiptstatus&txhash={txn_hash}&apikey={ETH_API_KEY}'
-        response = requests.get(url)
-        data = response.json()
-
-        if 'status' in data and data['status'] == '1':
-            txn_status = 'Approved'
-        else:
-            continue  # Saltar la actualización si la transacción no está aprobada
-
-    # Actualizar el estado de la transacción en el archivo de Excel
-    row_index = records.index(record) + 2  # Sumar 2 para tener en cuenta la fila de encabezado y el índice base 1
-    worksheet.update_cell(row_index, 10, txn_status)  # 8 es el número de columna de 'txn_status'
-
-    #if txn_status == 'Approved':
-    #    order_number = record['order_number']
-    #    order_data = {
-    #        'status': 'processing'  # Actualizar el estado de la orden a 'completed'
-    #    }
-    #    wcapi.put(f'orders/{order_number}', order_data)  # Actualizar la orden en WooCommerce
-
-print('Actualización de transacciones completada.')
+    if not record['wallet_address'] or amount_due(record) is None:
+        print(f"La orden {record['order_number']} ({record['store']}) no tiene billetera o monto, se deja para revisión manual")
+    else:
+        verifiable.append(record)
+
+# Agrupar por red, en lotes del tamaño que admite cada verificador
+by_network = {}
+for record in verifiable:
+    by_network.setdefault(record['network'], []).append(record)
+
+batches = []
+for network, records in by_network.items():
+    verifier = verifiers.get(network)
+    if verifier is None:
+        print(f'No hay verificador para la red {network}: {len(records)} transacciones sin verificar.')
+        continue
+    batches.extend((verifier, batch) for batch in chunks(records, verifier.batch_size))
+
+# Verificar los lotes en paralelo; los limitadores respetan la cuota de cada red
+with ThreadPoolExecutor(max_workers=VALIDATION_WORKERS) as pool:
+    confirmed = set().union(*pool.map(verify, batches))
+
+approved = [record for record in verifiable if record['txn_hash'] in confirmed]
+ledger.set_status([record['id'] for record in approved], 'Approved')
+
+# Reflejar el estado en la hoja, en una sola petición, para las filas ya exportadas.
+# Las que aún no se exportan llegan a la hoja con el estado del ledger.
+header = worksheet.row_values(1) if approved else []
+if 'txn_status' in header:
+    status_column = header.index('txn_status') + 1
+    updates = [
+        {'range': rowcol_to_a1(record['sheet_row'], status_column), 'values': [['Approved']]}
+        for record in approved
+        if record['sheet_row']
+    ]
+    if updates:
+        worksheet.batch_update(updates)
+
+# Pasar a 'processing' las órdenes aprobadas, por lotes en cada tienda. Sólo están
+# aprobadas las que llevaron el monto en USDT/USDC a nuestra billetera (ver verifiers.py).
+# El ledger guarda cuáles ya se actualizaron; las que fallaron, en esta o en una
+# ejecución anterior, se reintentan en la siguiente.
+def same_store(store, url):
+    normalize = lambda value: value.replace('https://', '').replace('http://', '').rstrip('/').lower()
+    return bool(url) and normalize(store) == normalize(url)
+
+unpromoted = ledger.unpromoted()
+promoted = []
+matched = 0
+for store, promote in stores:
+    records = [record for record in unpromoted if same_store(record['store'], store.key)]
+    if not records:
+        continue
+    matched += len(records)
+    failed = promote([record['order_number'] for record in records])
+    for order_number, error in failed.items():
+        print(f'No se pudo actualizar la orden {order_number} ({store.name}): {error}')
+    promoted.extend(record['id'] for record in records if str(record['order_number']) not in failed)
+ledger.mark_promoted(promoted)
+
+unmatched = len(unpromoted) - matched
+if unmatched:
+    print(f'{unmatched} órdenes aprobadas son de tiendas sin configurar y no se actualizaron.')
+
+print(f'Actualización de transacciones completada: {len(approved)} de {len(unapproved_records)} aprobadas, '
+      f'{len(promoted)} órdenes actualizadas en las tiendas.')
+
+# Latencias de las consultas a los exploradores y nodos, para el textfile collector de node_exporter
+if os.getenv('METRICS_TEXTFILE'):
+    write_textfile(os.getenv('METRICS_TEXTFILE'))
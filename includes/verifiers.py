@@ -0,0 +1,258 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from decimal import Decimal
+
+from includes.metrics import observe
+from includes.ratelimit import RateLimiter
+from includes.resilience import Dependency
+
+
+# Stablecoins accepted on each network: contract address -> decimals. Only
+# the official contracts, anyone can deploy a token called "USDT". TRON
+# addresses in base58, the rest in lower case. Other networks, or other
+# tokens, come with the verifier's configuration ("tokens").
+ACCEPTED_TOKENS = {
+    'TRON': {
+        'TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t': 6,  # USDT
+        'TEkxiTehnzSmSe2XqrBj4w32RUN966rdz8': 6,  # USDC
+    },
+    'ETH': {
+        '0xdac17f958d2ee523a2206206994597c13d831ec7': 6,  # USDT
+        '0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48': 6,  # USDC
+    },
+    'BSC': {
+        '0x55d398326f99059ff775485246999027b3197955': 18,  # USDT
+        '0x8ac76a51cc950d9822d68b83fe1ad97b32cd580d': 18,  # USDC
+    },
+    'POLYGON': {
+        '0xc2132d05d31c914a87c6611c10748aeb04b58e8f': 6,  # USDT
+        '0x3c499c542cef5e3811e1192ce70d8cc03d5c3359': 6,  # USDC
+    },
+}
+
+# keccak256("Transfer(address,address,uint256)"), the first topic of an ERC-20/TRC-20 transfer log
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+
+# Checks whether payments landed on a network. verify() gets up to
+# batch_size payments, dicts with the txn_hash the customer sent, our
+# wallet_address and the amount (USD) they had to pay, and returns the hashes
+# of those whose transaction succeeded and moved at least that amount of an
+# accepted token to that wallet. A payment without wallet or amount is never
+# confirmed. It raises if the lookup itself failed, so the caller can tell
+# "not confirmed" from "unknown".
+class ChainVerifier(ABC):
+    batch_size = 1
+    operation = None
+
+    def __init__(self, network, http, name=None, timeout=10, rps=5, tokens=None):
+        self.network = network
+        self.http = http
+        self.name = name or network.lower()
+        self.limiter = RateLimiter(rps)
+        self.dependency = Dependency(self.name, timeout=timeout)
+        tokens = tokens if tokens is not None else ACCEPTED_TOKENS.get(network, {})
+        self.tokens = {hex_address(address): int(decimals) for address, decimals in tokens.items()}
+
+    @abstractmethod
+    def verify(self, payments):
+        pass
+
+    # The transfers (to, amount) of a successful receipt in accepted tokens
+    def receipt_transfers(self, receipt):
+        transfers = []
+        for log in receipt.get('logs') or []:
+            topics = log.get('topics') or []
+            decimals = self.tokens.get(hex_address(log.get('address') or ''))
+            if decimals is None or len(topics) < 3 or topics[0].lower() != TRANSFER_TOPIC:
+                continue
+            transfers.append((f'0x{topics[2][-40:]}'.lower(), Decimal(int(log['data'], 16)) / 10 ** decimals))
+        return transfers
+
+    # Every attempt counts against the requests-per-second limit
+    def _send(self, method, url, **kwargs):
+        def send(timeout):
+            self.limiter.acquire()
+            return self.http.request(method, url, timeout=timeout, **kwargs)
+        with observe(self.name, self.operation):
+            response = self.dependency.request_sync(send, idempotent=True)
+            response.raise_for_status()
+            return response.json()
+
+
+# Whether the transfers add up to what the customer owed, all to our wallet
+def covers(transfers, payment):
+    if not payment.get('wallet_address') or payment.get('amount') is None:
+        return False
+    wallet = hex_address(payment['wallet_address'])
+    received = sum((amount for to, amount in transfers if to == wallet), Decimal(0))
+    return received > 0 and received >= Decimal(str(payment['amount']))
+
+
+# Any node with the Ethereum JSON-RPC API: ETH, BSC, Polygon and other EVM
+# chains, and TRON through TronGrid's /jsonrpc. A whole batch of receipts goes
+# in one POST. A payment is confirmed when its receipt has status 0x1,
+# `confirmations` blocks on top of it and a transfer that covers it; a
+# missing receipt (unknown or still pending) is not.
+class JSONRPCVerifier(ChainVerifier):
+    operation = 'eth_getTransactionReceipt'
+
+    def __init__(self, network, http, rpc_url, batch_size=100, confirmations=0, **kwargs):
+        super().__init__(network, http, **kwargs)
+        self.rpc_url = rpc_url
+        self.batch_size = batch_size
+        self.confirmations = confirmations
+
+    def verify(self, payments):
+        calls = [
+            {'jsonrpc': '2.0', 'id': i, 'method': 'eth_getTransactionReceipt', 'params': [rpc_hash(payment['txn_hash'])]}
+            for i, payment in enumerate(payments)
+        ]
+        if self.confirmations:
+            calls.append({'jsonrpc': '2.0', 'id': len(payments), 'method': 'eth_blockNumber', 'params': []})
+
+        replies = self._send('POST', self.rpc_url, json=calls)
+        # Un nodo sin soporte para lotes responde con un solo error
+        if not isinstance(replies, list):
+            raise ValueError(f"{self.network}: el nodo no aceptó el lote: {replies.get('error', replies)}")
+        results = {reply.get('id'): reply.get('result') for reply in replies}
+
+        head = int(results.get(len(payments)) or '0x0', 16) if self.confirmations else None
+        confirmed = set()
+        for i, payment in enumerate(payments):
+            receipt = results.get(i)
+            if not receipt or receipt.get('status') != '0x1':
+                continue
+            if head is not None and head - int(receipt['blockNumber'], 16) + 1 < self.confirmations:
+                continue
+            if covers(self.receipt_transfers(receipt), payment):
+                confirmed.add(payment['txn_hash'])
+        return confirmed
+
+
+# JSON-RPC wants 0x-prefixed hashes; TRON hashes are stored without it
+def rpc_hash(txn_hash):
+    txn_hash = txn_hash.strip()
+    return txn_hash if txn_hash.lower().startswith('0x') else f'0x{txn_hash}'
+
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+# Addresses as JSON-RPC shows them: 0x and 20 bytes in lower case. TRON's
+# base58 addresses are 0x41 + those 20 bytes + a checksum.
+def hex_address(address):
+    address = address.strip()
+    if len(address) == 34 and address.startswith('T'):
+        number = 0
+        for char in address:
+            number = number * 58 + BASE58_ALPHABET.index(char)
+        return f'0x{number.to_bytes(25, "big")[1:21].hex()}'
+    if len(address) == 42 and address.startswith('41'):
+        return f'0x{address[2:].lower()}'
+    return address.lower()
+
+
+# TronScan, one hash per request. Used for TRON when there is no node to ask.
+class TronscanVerifier(ChainVerifier):
+    operation = 'transaction-info'
+
+    def __init__(self, network, http, api_key='', api_url='https://apilist.tronscan.org/api/', **kwargs):
+        kwargs.setdefault('name', 'tronscan')
+        super().__init__(network, http, **kwargs)
+        self.api_url = api_url
+        self.api_key = api_key
+
+    def verify(self, payments):
+        confirmed = set()
+        for payment in payments:
+            data = self._send('GET', f'{self.api_url}transaction-info', params={'hash': payment['txn_hash']},
+                              headers={'TRON-PRO-API-KEY': self.api_key})
+            if not data.get('confirmed') or data.get('contractRet') != 'SUCCESS':
+                continue
+            transfers = []
+            for transfer in data.get('trc20TransferInfo') or []:
+                decimals = self.tokens.get(hex_address(transfer.get('contract_address') or ''))
+                if decimals is not None:
+                    transfers.append((hex_address(transfer.get('to_address') or ''), Decimal(transfer['amount_str']) / 10 ** decimals))
+            if covers(transfers, payment):
+                confirmed.add(payment['txn_hash'])
+        return confirmed
+
+
+# Etherscan's proxy to eth_getTransactionReceipt, one hash per request. Used
+# for ETH when there is no node to ask.
+class EtherscanVerifier(ChainVerifier):
+    operation = 'eth_getTransactionReceipt'
+
+    def __init__(self, network, http, api_key='', api_url='https://api.etherscan.io/api/', **kwargs):
+        kwargs.setdefault('name', 'etherscan')
+        super().__init__(network, http, **kwargs)
+        self.api_url = api_url
+        self.api_key = api_key
+
+    def verify(self, payments):
+        confirmed = set()
+        for payment in payments:
+            data = self._send('GET', self.api_url, params={
+                'module': 'proxy',
+                'action': 'eth_getTransactionReceipt',
+                'txhash': payment['txn_hash'],
+                'apikey': self.api_key,
+            })
+            # Errors (bad key, rate limit) come back as a string in result
+            receipt = data.get('result')
+            if not isinstance(receipt, dict) or receipt.get('status') != '0x1':
+                continue
+            if covers(self.receipt_transfers(receipt), payment):
+                confirmed.add(payment['txn_hash'])
+        return confirmed
+
+
+VERIFIER_TYPES = {
+    'jsonrpc': JSONRPCVerifier,
+    'tronscan': TronscanVerifier,
+    'etherscan': EtherscanVerifier,
+}
+
+
+# The verifier of each network
+class VerifierRegistry:
+    def __init__(self, verifiers=()):
+        self._verifiers = {}
+        for verifier in verifiers:
+            self.register(verifier)
+
+    def register(self, verifier):
+        self._verifiers[verifier.network] = verifier
+
+    def get(self, network):
+        return self._verifiers.get(network)
+
+    def __iter__(self):
+        return iter(self._verifiers.values())
+
+
+# Build a verifier from its configuration, e.g.
+#   {"network": "BSC", "type": "jsonrpc", "rpc_url": "${BSC_RPC_URL}", "batch_size": 100, "confirmations": 15}
+# Everything but network and type is passed to the verifier's constructor.
+def open_verifier(config, http, timeout=10):
+    options = dict(config)
+    network = options.pop('network')
+    kind = options.pop('type')
+    if kind not in VERIFIER_TYPES:
+        raise ValueError(f"Unknown verifier type for {network}: {kind}")
+    options.setdefault('timeout', timeout)
+    return VERIFIER_TYPES[kind](network, http, **options)
+
+
+# Verifier configurations from a JSON file (a list of objects). As in the
+# store configuration, string values can reference environment variables.
+def load_verifier_configs(path):
+    with open(path) as f:
+        configs = json.load(f)
+    return [
+        {name: os.path.expandvars(value) if isinstance(value, str) else value for name, value in config.items()}
+        for config in configs
+    ]
@@ -0,0 +1,139 @@
+import asyncio
+import hmac
+import json
+import signal
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from telegram import Update
+
+from includes.metrics import ready
+
+
+# Runs updates on a fixed pool of workers. Every chat is pinned to one worker
+# (chat_id modulo the pool size), so updates from the same chat are handled in
+# the order Telegram sent them while different chats run in parallel. Worker
+# queues are bounded: when they are full, submit() waits, the webhook response
+# is delayed and Telegram slows down instead of us buffering without limit.
+class ChatDispatcher:
+    def __init__(self, application, workers=32, queue_size=100):
+        self.application = application
+        self._queues = [asyncio.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._tasks = []
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._work(queue)) for queue in self._queues]
+
+    async def submit(self, update):
+        chat = update.effective_chat
+        key = chat.id if chat is not None else update.update_id
+        await self._queues[key % len(self._queues)].put(update)
+
+    # Let the workers finish what is already queued, then stop them
+    async def close(self):
+        for queue in self._queues:
+            await queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _work(self, queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self.application.process_update(update)
+            except Exception as e:
+                print(f"Error procesando la actualización {update.update_id}: {e}")
+            finally:
+                queue.task_done()
+
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+    def initialize(self, bot, dispatcher, secret_token):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.secret_token = secret_token
+
+    async def post(self):
+        token = self.request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token, self.secret_token):
+            raise tornado.web.HTTPError(403)
+
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+
+        if update is not None:
+            await self.dispatcher.submit(update)
+        self.set_status(200)
+
+
+# Serve the bots through Telegram webhooks instead of long polling. Mirrors
+# Application.run_webhook, but updates go through a ChatDispatcher. A single
+# bot is served at /<url_path> (webhook_url as given); with several, each
+# one at /<url_path>/<bot id> (webhook_url/<bot id>). The endpoint is public,
+# so updates must carry `secret_token` (Telegram sends it back in a header);
+# without it anyone could forge updates for any chat.
+def run_webhook(applications, webhook_url, listen="0.0.0.0", port=8080, url_path="telegram",
+                secret_token=None, workers=32, queue_size=100, max_connections=40):
+    if not secret_token:
+        raise ValueError("El webhook de Telegram necesita WEBHOOK_SECRET (1-256 caracteres: A-Z, a-z, 0-9, _ y -)")
+    asyncio.run(_serve(applications, webhook_url, listen, port, url_path, secret_token, workers, queue_size, max_connections))
+
+
+async def _serve(applications, webhook_url, listen, port, url_path, secret_token, workers, queue_size, max_connections):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    routes = []
+    dispatchers = []
+    webhook_urls = []
+    for application in applications:
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+
+        dispatcher = ChatDispatcher(application, workers=workers, queue_size=queue_size)
+        dispatcher.start()
+        dispatchers.append(dispatcher)
+
+        path, url = url_path.strip('/'), webhook_url
+        if len(applications) > 1:
+            bot_id = application.bot.token.split(':')[0]
+            path, url = f"{path}/{bot_id}", f"{webhook_url.rstrip('/')}/{bot_id}"
+        routes.append((rf"/{path}/?", TelegramWebhookHandler,
+                       dict(bot=application.bot, dispatcher=dispatcher, secret_token=secret_token)))
+        webhook_urls.append(url)
+
+    server = HTTPServer(tornado.web.Application(routes))
+    server.listen(port, address=listen)
+
+    for application, url in zip(applications, webhook_urls):
+        await application.bot.set_webhook(
+            url=url,
+            secret_token=secret_token,
+            max_connections=max_connections,
+            allowed_updates=Update.ALL_TYPES
+        )
+    print(f"Webhook escuchando en {listen}:{port}/{url_path.strip('/')}")
+    ready.set()
+
+    try:
+        await stop.wait()
+    finally:
+        ready.clear()
+        server.stop()
+        for application, dispatcher in zip(applications, dispatchers):
+            await dispatcher.close()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        for application in applications:
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
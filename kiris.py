@@ -0,0 +1,17 @@
+from dotenv import load_dotenv
+import os
+from includes.bot import Runtime
+from includes.stores import load_store_configs
+
+
+# Inicio del bot
+load_dotenv()
+
+# Todas las tiendas en un solo proceso (ver stores.example.json). Las tiendas
+# de un mismo bot se eligen con el prefijo del enlace: /start <prefijo>-<orden>.
+# Comparten el pool de conexiones, la caché de órdenes, la TRM, el ledger y su
+# exportación a Google Sheets.
+runtime = Runtime(load_store_configs(os.getenv('STORES_FILE', 'stores.json')))
+
+if __name__ == '__main__':
+    runtime.run()
@@ -0,0 +1,116 @@
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+
+import stubs
+from includes.verifiers import JSONRPCVerifier
+
+# JSONRPCVerifier against the JSON-RPC node of bench/stubs.py. The stub decides
+# each receipt from the hash: the last hex digit picks the outcome (even:
+# success, "f": reverted, other odd: no receipt) and how many blocks ago it
+# was mined, the one before it the USDT sent to stubs.RPC_WALLET.
+
+TRON_WALLET = '41' + stubs.RPC_WALLET[2:]  # The same 20 bytes, as TRON writes them in hex
+OTHER_WALLET = '0x' + '33' * 20
+
+
+def txn_hash(dollars, last, prefix='0x'):
+    return f'{prefix}{"ab" * 31}{dollars:x}{last:x}'
+
+
+def payment(txn_hash, amount, wallet_address=stubs.RPC_WALLET):
+    return {'txn_hash': txn_hash, 'wallet_address': wallet_address, 'amount': amount}
+
+
+@pytest.fixture(scope='module')
+def rpc_url():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    threading.Thread(target=stubs.serve, args=(port,), daemon=True).start()
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+    return f'http://127.0.0.1:{port}/rpc'
+
+
+@pytest.fixture
+def http():
+    with requests.Session() as session:
+        yield session
+
+
+def test_confirms_a_transfer_that_covers_the_amount(rpc_url, http):
+    verifier = JSONRPCVerifier('ETH', http, rpc_url)
+    assert verifier.verify([payment(txn_hash(9, 0), 9)]) == {txn_hash(9, 0)}
+
+
+def test_too_few_confirmations(rpc_url, http):
+    verifier = JSONRPCVerifier('ETH', http, rpc_url, confirmations=6)
+    # Mined 2 and 6 blocks before the head: 3 and 7 confirmations
+    recent, settled = txn_hash(9, 2), txn_hash(9, 6)
+    assert verifier.verify([payment(recent, 9), payment(settled, 9)]) == {settled}
+
+
+def test_reverted_receipt(rpc_url, http):
+    verifier = JSONRPCVerifier('ETH', http, rpc_url)
+    assert verifier.verify([payment(txn_hash(9, 15), 9)]) == set()
+
+
+def test_missing_receipt(rpc_url, http):
+    verifier = JSONRPCVerifier('ETH', http, rpc_url)
+    assert verifier.verify([payment(txn_hash(9, 3), 9)]) == set()
+
+
+def test_amount_below_due(rpc_url, http):
+    verifier = JSONRPCVerifier('ETH', http, rpc_url)
+    assert verifier.verify([payment(txn_hash(3, 0), 5)]) == set()
+    assert verifier.verify([payment(txn_hash(3, 0), 3)]) == {txn_hash(3, 0)}
+
+
+def test_wrong_wallet(rpc_url, http):
+    verifier = JSONRPCVerifier('ETH', http, rpc_url)
+    assert verifier.verify([payment(txn_hash(9, 0), 9, OTHER_WALLET)]) == set()
+
+
+def test_without_wallet_or_amount(rpc_url, http):
+    verifier = JSONRPCVerifier('ETH', http, rpc_url)
+    assert verifier.verify([payment(txn_hash(9, 0), None), payment(txn_hash(9, 4), 9, None)]) == set()
+
+
+def test_token_not_accepted(rpc_url, http):
+    # The stub's transfers are ETH USDT; BSC does not accept that contract
+    verifier = JSONRPCVerifier('BSC', http, rpc_url)
+    assert verifier.verify([payment(txn_hash(9, 0), 9)]) == set()
+
+
+def test_tron_hash_without_0x(rpc_url, http):
+    verifier = JSONRPCVerifier('TRON', http, rpc_url, tokens={stubs.RPC_TOKEN: 6})
+    tron_hash = txn_hash(9, 0, prefix='')
+    assert verifier.verify([payment(tron_hash, 9, TRON_WALLET)]) == {tron_hash}
+
+
+def test_one_request_per_batch(rpc_url, http):
+    verifier = JSONRPCVerifier('ETH', http, rpc_url, confirmations=6)
+    payments = [payment(txn_hash(dollars, last), 5) for dollars in range(16) for last in range(16)]
+    before = stubs.JSONRPCHandler.requests
+    confirmed = verifier.verify(payments)
+    assert stubs.JSONRPCHandler.requests - before == 1
+    assert confirmed == {
+        txn_hash(dollars, last) for dollars in range(5, 16) for last in range(6, 16, 2)
+    }